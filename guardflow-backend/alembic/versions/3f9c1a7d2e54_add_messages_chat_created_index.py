@@ -0,0 +1,24 @@
+"""add_messages_chat_created_index
+
+Revision ID: 3f9c1a7d2e54
+Revises: efe34b1df734
+Create Date: 2026-10-16 10:12:41.503218
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f9c1a7d2e54'
+down_revision = 'efe34b1df734'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_messages_chat_created', 'messages', ['chat_id', 'created_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_messages_chat_created', table_name='messages')
\ No newline at end of file
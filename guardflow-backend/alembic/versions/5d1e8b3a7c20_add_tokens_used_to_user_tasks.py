@@ -0,0 +1,24 @@
+"""add_tokens_used_to_user_tasks
+
+Revision ID: 5d1e8b3a7c20
+Revises: b7e2d4c81f09
+Create Date: 2026-10-16 13:24:08.617302
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d1e8b3a7c20'
+down_revision = 'b7e2d4c81f09'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('user_tasks', sa.Column('tokens_used', sa.Integer(), server_default=sa.text('0'), nullable=False))
+
+
+def downgrade() -> None:
+    op.drop_column('user_tasks', 'tokens_used')
\ No newline at end of file
@@ -0,0 +1,42 @@
+"""make_usage_and_quota_columns_not_null
+
+Revision ID: 8c4f2e6a9b13
+Revises: 5d1e8b3a7c20
+Create Date: 2026-10-16 15:41:52.930174
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c4f2e6a9b13'
+down_revision = '5d1e8b3a7c20'
+branch_labels = None
+depends_on = None
+
+# (table, column, server default); NULL meant 0 (no usage / no limit) before
+COLUMNS = [
+    ('users', 'current_daily_usage', '0'),
+    ('users', 'current_monthly_usage', '0'),
+    ('users', 'daily_quota', '10000'),
+    ('users', 'monthly_quota', '300000'),
+    ('tasks', 'token_limit', '10000'),
+]
+
+
+def upgrade() -> None:
+    for table, column, default in COLUMNS:
+        op.execute(f"UPDATE {table} SET {column} = 0 WHERE {column} IS NULL")
+        op.alter_column(table, column,
+                        existing_type=sa.Integer(),
+                        server_default=sa.text(default),
+                        nullable=False)
+
+
+def downgrade() -> None:
+    for table, column, default in reversed(COLUMNS):
+        op.alter_column(table, column,
+                        existing_type=sa.Integer(),
+                        server_default=None,
+                        nullable=True)
\ No newline at end of file
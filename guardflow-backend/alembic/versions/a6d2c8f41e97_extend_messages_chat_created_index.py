@@ -0,0 +1,31 @@
+"""extend_messages_chat_created_index
+
+Revision ID: a6d2c8f41e97
+Revises: e41a9c7b5d26
+Create Date: 2026-10-16 17:41:22.306815
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a6d2c8f41e97'
+down_revision = 'e41a9c7b5d26'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Message pages are keyed on (created_at, id); swap the index without blocking sends
+    with op.get_context().autocommit_block():
+        op.create_index('ix_messages_chat_created_id', 'messages', ['chat_id', 'created_at', 'id'], unique=False,
+                        postgresql_concurrently=True)
+        op.drop_index('ix_messages_chat_created', table_name='messages', postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index('ix_messages_chat_created', 'messages', ['chat_id', 'created_at'], unique=False,
+                        postgresql_concurrently=True)
+        op.drop_index('ix_messages_chat_created_id', table_name='messages', postgresql_concurrently=True)
\ No newline at end of file
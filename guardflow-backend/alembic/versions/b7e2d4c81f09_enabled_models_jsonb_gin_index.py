@@ -0,0 +1,41 @@
+"""enabled_models_jsonb_gin_index
+
+Revision ID: b7e2d4c81f09
+Revises: 3f9c1a7d2e54
+Create Date: 2026-10-16 11:02:17.284915
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7e2d4c81f09'
+down_revision = '3f9c1a7d2e54'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.alter_column('llm_providers', 'enabled_models',
+                    type_=postgresql.JSONB(),
+                    postgresql_using='enabled_models::jsonb',
+                    server_default=sa.text("'[]'::jsonb"))
+    
+    # Build the index without blocking writes to llm_providers
+    with op.get_context().autocommit_block():
+        op.create_index('idx_llmprovider_models', 'llm_providers', ['enabled_models'], unique=False,
+                        postgresql_using='gin',
+                        postgresql_ops={'enabled_models': 'jsonb_path_ops'},
+                        postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('idx_llmprovider_models', table_name='llm_providers', postgresql_concurrently=True)
+    
+    op.alter_column('llm_providers', 'enabled_models',
+                    type_=sa.JSON(),
+                    postgresql_using='enabled_models::json',
+                    server_default=sa.text("'[]'"))
\ No newline at end of file
@@ -0,0 +1,28 @@
+"""add_logs_user_timestamp_index
+
+Revision ID: e41a9c7b5d26
+Revises: 8c4f2e6a9b13
+Create Date: 2026-10-16 16:27:05.118642
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e41a9c7b5d26'
+down_revision = '8c4f2e6a9b13'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Build the index without blocking inserts into logs
+    with op.get_context().autocommit_block():
+        op.create_index('ix_logs_user_ts', 'logs', ['user_id', sa.text('timestamp DESC')], unique=False,
+                        postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_logs_user_ts', table_name='logs', postgresql_concurrently=True)
\ No newline at end of file
@@ -1,12 +1,15 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query, status
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from typing import List, Optional
+from datetime import datetime
 import uuid
 
 from app.database import get_db
 from app.api.deps import get_current_user_from_jwt
 from app.models.user import User
 from app.services.chat_service import ChatService
+from app.services.openai_service import OpenAIService, get_openai_service
 from app.schemas.chat import (
     ChatCreateRequest,
     MessageSendRequest,
@@ -63,13 +66,22 @@ async def get_user_chats(
 @router.get("/{chat_id}", response_model=ChatWithMessagesResponse)
 async def get_chat_with_messages(
     chat_id: uuid.UUID,
+    after: Optional[datetime] = None,
+    after_id: Optional[uuid.UUID] = None,
+    limit: Optional[int] = Query(None, ge=1, le=1000),
     current_user: User = Depends(get_current_user_from_jwt),
     db: Session = Depends(get_db)
 ):
-    """Get a specific chat with all its messages"""
+    """Get a specific chat with its messages (optionally paged with after/after_id/limit)"""
+    if after is not None and after_id is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="after_id is required when paging with after"
+        )
+    
     try:
         chat_service = ChatService(db)
-        chat = await chat_service.get_chat_with_messages(chat_id, current_user.id)
+        chat = await chat_service.get_chat_with_messages(chat_id, current_user.id, after, limit, after_id)
         return chat
     except ValueError as e:
         raise HTTPException(
@@ -86,13 +98,15 @@ async def get_chat_with_messages(
 @router.post("/send", response_model=SendMessageResponse)
 async def send_message(
     request: MessageSendRequest,
+    background_tasks: BackgroundTasks,
     current_user: User = Depends(get_current_user_from_jwt),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    openai_service: OpenAIService = Depends(get_openai_service)
 ):
     """Send a message and get AI response"""
     try:
-        chat_service = ChatService(db)
-        response = await chat_service.send_message(current_user.id, request)
+        chat_service = ChatService(db, openai_service)
+        response = await chat_service.send_message(current_user.id, request, background_tasks)
         return response
     except ValueError as e:
         if "Token limit exceeded" in str(e):
@@ -112,6 +126,38 @@ async def send_message(
         )
 
 
+@router.post("/send/stream")
+async def send_message_stream(
+    request: MessageSendRequest,
+    background_tasks: BackgroundTasks,
+    current_user: User = Depends(get_current_user_from_jwt),
+    db: Session = Depends(get_db),
+    openai_service: OpenAIService = Depends(get_openai_service)
+):
+    """Send a message and stream the AI response as server-sent events"""
+    try:
+        chat_service = ChatService(db, openai_service)
+        stream = await chat_service.send_message_stream(current_user.id, request, background_tasks)
+    except ValueError as e:
+        if "Token limit exceeded" in str(e):
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail=str(e)
+            )
+        else:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=str(e)
+            )
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to send message"
+        )
+    
+    return StreamingResponse(stream, media_type="text/event-stream")
+
+
 @router.get("/task/{task_id}/context", response_model=TaskContext)
 async def get_task_context(
     task_id: int,
@@ -12,7 +12,7 @@ from app.schemas.llm_provider import (
     LLMProviderTestResult,
     ModelOption
 )
-from app.services.llm_router import SimpleLLMRouter
+from app.services.llm_router import SimpleLLMRouter, discard_provider_clients
 
 router = APIRouter()
 
@@ -31,7 +31,7 @@ def list_providers(
 
 
 @router.post("", response_model=LLMProviderResponse)
-def create_provider(
+async def create_provider(
     provider_data: LLMProviderCreate,
     db: Session = Depends(get_db),
     tenant: Tenant = Depends(get_tenant_from_user),
@@ -54,7 +54,7 @@ def create_provider(
         )
     
     # Encrypt API key
-    encrypted_key = llm_router.encrypt_api_key(provider_data.api_key)
+    encrypted_key = await llm_router.encrypt_api_key_async(provider_data.api_key)
     
     # Create provider
     provider = LLMProvider(
@@ -69,7 +69,7 @@ def create_provider(
     )
     
     # Test connection and get available models
-    test_result = llm_router.test_provider_connection(provider)
+    test_result = await llm_router.test_provider_connection(provider)
     if test_result["success"]:
         provider.available_models = test_result["available_models"]
         # If no enabled models specified, enable all available ones
@@ -111,7 +111,7 @@ def get_provider(
 
 
 @router.put("/{provider_id}", response_model=LLMProviderResponse)
-def update_provider(
+async def update_provider(
     provider_id: str,
     provider_data: LLMProviderUpdate,
     db: Session = Depends(get_db),
@@ -132,7 +132,7 @@ def update_provider(
     
     # Handle API key encryption if provided
     if "api_key" in update_data:
-        update_data["api_key_encrypted"] = llm_router.encrypt_api_key(update_data["api_key"])
+        update_data["api_key_encrypted"] = await llm_router.encrypt_api_key_async(update_data["api_key"])
         del update_data["api_key"]
     
     # Handle default provider logic
@@ -150,12 +150,13 @@ def update_provider(
     
     # Re-test connection if API key or endpoint changed
     if "api_key_encrypted" in update_data or "api_endpoint" in update_data:
-        test_result = llm_router.test_provider_connection(provider)
+        test_result = await llm_router.test_provider_connection(provider)
         if test_result["success"]:
             provider.available_models = test_result["available_models"]
     
     db.commit()
     db.refresh(provider)
+    discard_provider_clients(provider_id)
     
     return provider
 
@@ -190,12 +191,13 @@ def delete_provider(
     
     db.delete(provider)
     db.commit()
+    discard_provider_clients(provider_id)
     
     return {"message": "Provider deleted successfully"}
 
 
 @router.post("/test", response_model=LLMProviderTestResult)
-def test_provider(
+async def test_provider(
     test_data: LLMProviderTest,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_tenant_admin_user)
@@ -210,9 +212,9 @@ def test_provider(
     )
     
     llm_router = SimpleLLMRouter(db)
-    temp_provider.api_key_encrypted = llm_router.encrypt_api_key(test_data.api_key)
+    temp_provider.api_key_encrypted = await llm_router.encrypt_api_key_async(test_data.api_key)
     
-    result = llm_router.test_provider_connection(temp_provider)
+    result = await llm_router.test_provider_connection(temp_provider)
     
     return LLMProviderTestResult(
         success=result["success"],
@@ -221,6 +223,30 @@ def test_provider(
     )
 
 
+@router.post("/test-all", response_model=List[LLMProviderTestResult])
+async def test_all_providers(
+    db: Session = Depends(get_db),
+    tenant: Tenant = Depends(get_tenant_from_user),
+    current_user: User = Depends(get_tenant_admin_user)
+):
+    """Test connections for all of the tenant's providers in parallel"""
+    providers = db.query(LLMProvider).filter(
+        LLMProvider.tenant_id == tenant.id
+    ).all()
+    
+    llm_router = SimpleLLMRouter(db)
+    results = await llm_router.test_providers_bulk(providers)
+    
+    return [
+        LLMProviderTestResult(
+            success=result["success"],
+            available_models=result["available_models"],
+            error=result.get("error")
+        )
+        for result in results
+    ]
+
+
 @router.get("/{provider_id}/models", response_model=List[ModelOption])
 def get_provider_models(
     provider_id: str,
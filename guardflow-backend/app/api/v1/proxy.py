@@ -1,9 +1,11 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Request
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from typing import List, Union
+from typing import Any, Dict, List, Union
+from redis import Redis
 
 from app.database import get_db
-from app.api.deps import get_current_user_from_api_token, check_rate_limit, check_task_quota, require_scope
+from app.api.deps import get_current_user_from_api_token, check_rate_limit, check_task_quota, require_scope, get_redis
 from app.models.user import User
 from app.models.user_task import UserTask
 from app.models.task import Task
@@ -11,15 +13,20 @@ from app.schemas.proxy import ChatCompletionRequest, ChatCompletionResponse, Min
 from app.services.proxy_service import ProxyService
 from app.services.quota_tracking_service import QuotaTrackingService
 from app.services.safety_filter_service import safety_filter
+from app.core.tokenizer import count_tokens_batch
 
 router = APIRouter()
 
+# Chat formatting tokens on top of the message contents
+MESSAGE_OVERHEAD_TOKENS = 16
+
 
 @router.post("/completions", response_model=Union[ChatCompletionResponse, MinimalResponse])
 async def chat_completions(
     request: ChatCompletionRequest,
     http_request: Request,
     db: Session = Depends(get_db),
+    redis_client: Redis = Depends(get_redis),
     current_user: User = Depends(require_scope("llm:call"))
 ):
     """
@@ -70,14 +77,16 @@ async def chat_completions(
         )
     
     # Initialize services
-    quota_service = QuotaTrackingService(db)
+    quota_service = QuotaTrackingService(db, redis_client)
     proxy_service = ProxyService(db)
     
-    # Estimate tokens for this request
-    estimated_tokens = sum(len(msg.content.split()) for msg in request.messages) * 1.4
-    estimated_tokens = int(max(estimated_tokens, 10))  # Minimum estimate
+    # Estimate tokens for this request with the model's tokenizer (no network call)
+    estimated_tokens = sum(count_tokens_batch(
+        [msg.content for msg in request.messages],
+        request.model or "gpt-3.5-turbo"
+    )) + MESSAGE_OVERHEAD_TOKENS
     
-    # Check quotas before processing
+    # Check quotas before processing (reserves the estimate in Redis)
     quota_check = quota_service.check_quotas_before_request(
         user=current_user,
         task=task,
@@ -92,14 +101,22 @@ async def chat_completions(
         )
     
     # Route to appropriate processing flow
-    if task.is_dummy_task:
-        response = await _process_dummy_task_request(
-            request, current_user, task, user_task, quota_service, proxy_service
-        )
-    else:
-        response = await _process_regular_task_request(
-            request, current_user, task, user_task, quota_service, proxy_service
-        )
+    try:
+        if request.stream:
+            return _stream_task_request(
+                request, current_user, task, user_task, quota_service, proxy_service, estimated_tokens
+            )
+        if task.is_dummy_task:
+            response = await _process_dummy_task_request(
+                request, current_user, task, user_task, quota_service, proxy_service, estimated_tokens
+            )
+        else:
+            response = await _process_regular_task_request(
+                request, current_user, task, user_task, quota_service, proxy_service, estimated_tokens
+            )
+    except HTTPException:
+        quota_service.release_reservation(current_user, task, estimated_tokens, user_task)
+        raise
     
     # Return minimal format if requested
     if request.format == "minimal":
@@ -116,26 +133,12 @@ async def _process_dummy_task_request(
     task: Task,
     user_task: UserTask,
     quota_service: QuotaTrackingService,
-    proxy_service: ProxyService
+    proxy_service: ProxyService,
+    reserved_tokens: int
 ) -> ChatCompletionResponse:
     """Process request for dummy tasks (simplified flow)"""
     
-    # Basic safety filtering for dummy tasks
-    safety_check = safety_filter.check_messages_safety([
-        {"content": msg.content} for msg in request.messages
-    ])
-    
-    if not safety_check["safe"]:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Content safety check failed: {', '.join(safety_check['reasons'])}"
-        )
-    
-    # Log warning for medium risk content
-    if safety_check["action"] == "warn":
-        import logging
-        logger = logging.getLogger(__name__)
-        logger.warning(f"Medium risk content from user {current_user.id} in dummy task {task.id}: {safety_check['reasons']}")
+    _check_dummy_task_safety(request, current_user, task)
     
     try:
         # Process request without intent classification
@@ -152,7 +155,8 @@ async def _process_dummy_task_request(
             user=current_user,
             task=task,
             tokens_used=response.usage.total_tokens,
-            user_task=user_task
+            user_task=user_task,
+            reserved_tokens=reserved_tokens
         )
         
         return response
@@ -170,7 +174,8 @@ async def _process_regular_task_request(
     task: Task,
     user_task: UserTask,
     quota_service: QuotaTrackingService,
-    proxy_service: ProxyService
+    proxy_service: ProxyService,
+    reserved_tokens: int
 ) -> ChatCompletionResponse:
     """Process request for regular tasks (full monitoring flow)"""
     
@@ -185,12 +190,13 @@ async def _process_regular_task_request(
             user_agent="Guardflow API"
         )
         
-        # Update quotas (both task and user quotas)
+        # Update quotas (both task and user quotas); a reused completion costs nothing
         quota_service.update_task_usage(
             user=current_user,
             task=task,
-            tokens_used=response.usage.total_tokens,
-            user_task=user_task
+            tokens_used=0 if response.cached else response.usage.total_tokens,
+            user_task=user_task,
+            reserved_tokens=reserved_tokens
         )
         
         return response
@@ -199,4 +205,87 @@ async def _process_regular_task_request(
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Regular task processing error: {str(e)}"
-        )
\ No newline at end of file
+        )
+
+
+def _check_dummy_task_safety(request: ChatCompletionRequest, current_user: User, task: Task) -> None:
+    """Basic safety filtering for dummy tasks"""
+    safety_check = safety_filter.check_messages_safety([
+        {"content": msg.content} for msg in request.messages
+    ])
+    
+    if not safety_check["safe"]:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Content safety check failed: {', '.join(safety_check['reasons'])}"
+        )
+    
+    # Log warning for medium risk content
+    if safety_check["action"] == "warn":
+        import logging
+        logger = logging.getLogger(__name__)
+        logger.warning(f"Medium risk content from user {current_user.id} in dummy task {task.id}: {safety_check['reasons']}")
+
+
+def _stream_task_request(
+    request: ChatCompletionRequest,
+    current_user: User,
+    task: Task,
+    user_task: UserTask,
+    quota_service: QuotaTrackingService,
+    proxy_service: ProxyService,
+    reserved_tokens: int
+) -> StreamingResponse:
+    """Stream the completion as server-sent events, settling the quota reservation when it ends"""
+    
+    usage: Dict[str, Any] = {}
+    
+    try:
+        if task.is_dummy_task:
+            _check_dummy_task_safety(request, current_user, task)
+            events = proxy_service.process_simple_request_stream(
+                user=current_user,
+                task_id=request.task_id,
+                messages=request.messages,
+                model=request.model,
+                usage=usage
+            )
+        else:
+            events = proxy_service.process_request_stream(
+                user=current_user,
+                task_id=request.task_id,
+                messages=request.messages,
+                model=request.model,
+                ip_address="127.0.0.1",  # Will be enhanced later
+                user_agent="Guardflow API",
+                usage=usage
+            )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Streaming request error: {str(e)}"
+        )
+    
+    async def settle_quota(events):
+        try:
+            async for event in events:
+                yield event
+        finally:
+            # Close the inner stream first so its scoring and logging run now, even on disconnect
+            await events.aclose()
+            
+            # Charge whatever the model produced (a partial stream included), or hand the reservation back
+            if "total_tokens" in usage:
+                quota_service.update_task_usage(
+                    user=current_user,
+                    task=task,
+                    tokens_used=usage["total_tokens"],
+                    user_task=user_task,
+                    reserved_tokens=reserved_tokens
+                )
+            else:
+                quota_service.release_reservation(current_user, task, reserved_tokens, user_task)
+    
+    return StreamingResponse(settle_quota(events), media_type="text/event-stream")
\ No newline at end of file
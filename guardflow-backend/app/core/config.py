@@ -64,6 +64,8 @@ class Settings(BaseSettings):
     # Scoring
     DEVIATION_THRESHOLD: float = 2.0
     WARNING_THRESHOLD: float = 1.0
+    LOCAL_INTENT_CLASSIFIER: bool = False  # Classify intent locally instead of asking the model
+    PROXY_RESPONSE_CACHE_TTL: int = 0  # Seconds to reuse a user's completion for a repeated prompt (0 disables; repeats return identical text)
     
     # Celery
     CELERY_BROKER_URL: str = "redis://localhost:6379/1"
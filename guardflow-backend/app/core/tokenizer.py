@@ -0,0 +1,27 @@
+from functools import lru_cache
+from typing import List
+
+import tiktoken
+
+# Encoding used when tiktoken does not recognise a model name
+DEFAULT_ENCODING = "cl100k_base"
+
+
+@lru_cache(maxsize=32)
+def get_encoding(model: str) -> tiktoken.Encoding:
+    """Get the (cached) tokenizer for a model"""
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding(DEFAULT_ENCODING)
+
+
+def count_tokens(text: str, model: str = "gpt-3.5-turbo") -> int:
+    """Count the tokens a piece of text will use for the given model"""
+    return len(get_encoding(model).encode(text))
+
+
+def count_tokens_batch(texts: List[str], model: str = "gpt-3.5-turbo", num_threads: int = 4) -> List[int]:
+    """Count tokens for many texts at once (encodes in parallel threads)"""
+    encoded = get_encoding(model).encode_batch(texts, num_threads=num_threads)
+    return [len(tokens) for tokens in encoded]
@@ -5,6 +5,8 @@ from fastapi.responses import RedirectResponse
 
 from app.core.config import settings
 from app.api.v1.api import api_router
+from app.services.quota_coalescer import quota_coalescer
+from app.services.llm_router import close_llm_clients
 
 # Create FastAPI application
 app = FastAPI(
@@ -36,6 +38,18 @@ app.add_middleware(
 app.include_router(api_router, prefix=settings.API_V1_STR)
 
 
+@app.on_event("shutdown")
+async def flush_queued_usage():
+    """Write any usage and logs still queued by the quota coalescer"""
+    await quota_coalescer.drain()
+
+
+@app.on_event("shutdown")
+async def close_provider_clients():
+    """Close pooled connections held by cached LLM provider clients"""
+    await close_llm_clients()
+
+
 # Root endpoint
 @app.get("/")
 async def root():
@@ -1,4 +1,5 @@
-from sqlalchemy import Column, String, Text, Boolean, DateTime, JSON, ForeignKey, UniqueConstraint, text
+from sqlalchemy import Column, String, Text, Boolean, DateTime, JSON, ForeignKey, UniqueConstraint, Index, text
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 
@@ -24,7 +25,7 @@ class LLMProvider(Base):
     
     # Model configuration
     available_models = Column(JSON, default=list)  # Auto-detected: ["gpt-4", "gpt-3.5-turbo"]
-    enabled_models = Column(JSON, default=list)    # What tenant wants to use
+    enabled_models = Column(JSONB, default=list)   # What tenant wants to use
     
     # Status and settings
     is_default = Column(Boolean, default=False)    # Default key for this provider
@@ -41,6 +42,8 @@ class LLMProvider(Base):
     __table_args__ = (
         UniqueConstraint('tenant_id', 'provider_name', 'provider_instance_name', 
                         name='uq_tenant_provider_instance'),
+        Index('idx_llmprovider_models', 'enabled_models', postgresql_using='gin',
+              postgresql_ops={'enabled_models': 'jsonb_path_ops'}),
     )
     
     def __repr__(self):
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, DECIMAL, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, Text, DECIMAL, DateTime, ForeignKey, Index
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from sqlalchemy.dialects.postgresql import INET
@@ -52,6 +52,11 @@ class Log(Base):
     # Timestamps
     timestamp = Column(DateTime(timezone=True), server_default=func.now(), index=True)
     
+    __table_args__ = (
+        # Per-user recent-activity windows (deviation scoring, behavior analysis)
+        Index("ix_logs_user_ts", user_id, timestamp.desc()),
+    )
+    
     # Relationships
     tenant = relationship("Tenant", back_populates="logs")
     user = relationship("User", back_populates="logs")
@@ -1,6 +1,6 @@
-from sqlalchemy import Column, Integer, String, Text, Boolean, DateTime, ForeignKey, JSON, Float
+from sqlalchemy import Column, Integer, String, Text, Boolean, DateTime, ForeignKey, JSON, Float, text
 from sqlalchemy.sql import func
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, reconstructor, validates
 
 from app.database import Base
 
@@ -25,7 +25,7 @@ class Task(Base):
     
     # Task limits and quotas
     estimated_hours = Column(Float)
-    token_limit = Column(Integer, default=10000)
+    token_limit = Column(Integer, nullable=False, default=10000, server_default=text("10000"))
     max_tokens_per_request = Column(Integer, default=1000)  # Prevent single expensive requests
     
     # Task configuration (keeping existing fields for compatibility)
@@ -49,6 +49,23 @@ class Task(Base):
     logs = relationship("Log", back_populates="task")
     alerts = relationship("Alert", back_populates="task")
     
+    # Prompt-ready and set forms of allowed_intents, kept in sync on load and on assignment
+    allowed_intents_str = "Any"
+    allowed_intents_set = frozenset()
+    
+    def _cache_allowed_intents(self, allowed_intents) -> None:
+        self.allowed_intents_str = ", ".join(allowed_intents) if allowed_intents else "Any"
+        self.allowed_intents_set = frozenset(allowed_intents or ())
+    
+    @reconstructor
+    def _init_on_load(self):
+        self._cache_allowed_intents(self.allowed_intents)
+    
+    @validates("allowed_intents")
+    def _validate_allowed_intents(self, key, allowed_intents):
+        self._cache_allowed_intents(allowed_intents)
+        return allowed_intents
+    
     @classmethod
     def create_dummy_task(cls, user_id: int, tenant_id: str, user_name: str):
         """Create a dummy task for API access"""
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, DECIMAL, DateTime, Text, ForeignKey
+from sqlalchemy import Column, Integer, String, Boolean, DECIMAL, DateTime, Text, ForeignKey, text
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 
@@ -22,10 +22,10 @@ class User(Base):
     token_hash = Column(String(255), unique=True, index=True, nullable=False)
     
     # Quotas and limits
-    daily_quota = Column(Integer, default=10000)
-    monthly_quota = Column(Integer, default=300000)
-    current_daily_usage = Column(Integer, default=0)
-    current_monthly_usage = Column(Integer, default=0)
+    daily_quota = Column(Integer, nullable=False, default=10000, server_default=text("10000"))
+    monthly_quota = Column(Integer, nullable=False, default=300000, server_default=text("300000"))
+    current_daily_usage = Column(Integer, nullable=False, default=0, server_default=text("0"))
+    current_monthly_usage = Column(Integer, nullable=False, default=0, server_default=text("0"))
     
     # Rate limiting
     requests_per_hour = Column(Integer, default=100)
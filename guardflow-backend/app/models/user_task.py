@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, Boolean, DateTime, ForeignKey, UniqueConstraint, Text
+from sqlalchemy import Column, Integer, Boolean, DateTime, ForeignKey, UniqueConstraint, Text, text
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 
@@ -24,6 +24,9 @@ class UserTask(Base):
     progress_notes = Column(Text)
     completed_at = Column(DateTime(timezone=True))
     
+    # Tokens this user has spent on the task (incremented atomically per request)
+    tokens_used = Column(Integer, nullable=False, default=0, server_default=text("0"))
+    
     # No task-specific limits needed - use task.token_limit
     
     # Constraints
@@ -16,6 +16,7 @@ class ChatCompletionRequest(BaseModel):
     temperature: Optional[float] = 1.0
     top_p: Optional[float] = 1.0
     format: Optional[str] = "full"  # "full" or "minimal"
+    stream: Optional[bool] = False  # Server-sent chat.completion.chunk events
 
 
 class ChatChoice(BaseModel):
@@ -42,6 +43,7 @@ class ChatCompletionResponse(BaseModel):
     intent_classification: Optional[str] = None
     confidence_score: Optional[float] = None
     deviation_score_delta: Optional[float] = None
+    cached: bool = False  # Reused from an earlier identical request; no upstream tokens spent
 
 
 class MinimalResponse(BaseModel):
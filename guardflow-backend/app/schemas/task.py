@@ -9,7 +9,7 @@ class TaskBase(BaseModel):
     category: str = "other"
     difficulty_level: str = "beginner"
     estimated_hours: Optional[float] = None
-    token_limit: Optional[int] = 10000
+    token_limit: int = 10000
     max_tokens_per_request: Optional[int] = 1000
     is_active: bool = True
     llm_provider_id: Optional[str] = None  # New field for LLM provider selection
@@ -10,8 +10,8 @@ class UserBase(BaseModel):
 
 
 class UserCreate(UserBase):
-    daily_quota: Optional[int] = 10000
-    monthly_quota: Optional[int] = 300000
+    daily_quota: int = 10000
+    monthly_quota: int = 300000
     requests_per_hour: Optional[int] = 100
 
 
@@ -1,6 +1,11 @@
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional, Tuple
 from sqlalchemy.orm import Session
+from sqlalchemy import func, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from datetime import datetime, timedelta
+import threading
+
+from cachetools import TTLCache
 
 from app.models.user import User
 from app.models.task import Task
@@ -10,6 +15,34 @@ from app.schemas.user import UserCreate, UserUpdate
 from app.schemas.task import TaskCreate, TaskUpdate
 from app.core.security import generate_api_token, hash_api_token
 
+# Dashboard analytics are cached briefly; admin writes bump the version so stale
+# entries are simply never looked up again and age out via the TTL.
+_analytics_cache: TTLCache = TTLCache(maxsize=64, ttl=60)
+_analytics_lock = threading.Lock()
+_analytics_version = 0
+
+
+def _analytics_key(*parts) -> Tuple:
+    with _analytics_lock:
+        return (_analytics_version, *parts)
+
+
+def _get_cached_analytics(key: Tuple) -> Optional[Dict[str, Any]]:
+    with _analytics_lock:
+        return _analytics_cache.get(key)
+
+
+def _store_cached_analytics(key: Tuple, value: Dict[str, Any]) -> None:
+    with _analytics_lock:
+        _analytics_cache[key] = value
+
+
+def invalidate_analytics_cache() -> None:
+    """Force the next analytics read to hit the database"""
+    global _analytics_version
+    with _analytics_lock:
+        _analytics_version += 1
+
 
 class AdminService:
     def __init__(self, db: Session):
@@ -35,6 +68,7 @@ class AdminService:
         self.db.add(user)
         self.db.commit()
         self.db.refresh(user)
+        invalidate_analytics_cache()
         
         # Store the plain token temporarily for return
         user.plain_token = api_token
@@ -44,54 +78,63 @@ class AdminService:
     async def update_user(self, user_id: int, user_data: UserUpdate) -> User:
         """Update user information"""
         
-        user = self.db.query(User).filter(User.id == user_id).first()
+        # Single UPDATE ... RETURNING; populate_existing refreshes any copy already in the session
+        user = self.db.scalars(
+            update(User)
+            .where(User.id == user_id)
+            .values(**user_data.model_dump(exclude_unset=True, exclude_none=True), updated_at=func.now())
+            .returning(User),
+            execution_options={"populate_existing": True}
+        ).first()
         if not user:
             raise ValueError(f"User {user_id} not found")
         
-        # Update fields
-        for field, value in user_data.dict(exclude_unset=True).items():
-            setattr(user, field, value)
-        
-        user.updated_at = datetime.utcnow()
-        
         self.db.commit()
-        self.db.refresh(user)
+        invalidate_analytics_cache()
         
         return user
 
     async def block_user(self, user_id: int, reason: str) -> Dict[str, Any]:
         """Block a user"""
         
-        user = self.db.query(User).filter(User.id == user_id).first()
-        if not user:
+        row = self.db.execute(
+            update(User)
+            .where(User.id == user_id)
+            .values(is_blocked=True, blocked_reason=reason, blocked_at=func.now())
+            .returning(User.id, User.blocked_at)
+        ).first()
+        if not row:
             raise ValueError(f"User {user_id} not found")
         
-        user.is_blocked = True
-        user.blocked_reason = reason
-        user.blocked_at = datetime.utcnow()
-        
         self.db.commit()
+        invalidate_analytics_cache()
         
         return {
             "user_id": user_id,
             "blocked": True,
             "reason": reason,
-            "blocked_at": user.blocked_at.isoformat()
+            "blocked_at": row.blocked_at.isoformat()
         }
 
     async def unblock_user(self, user_id: int) -> Dict[str, Any]:
         """Unblock a user"""
         
-        user = self.db.query(User).filter(User.id == user_id).first()
-        if not user:
+        row = self.db.execute(
+            update(User)
+            .where(User.id == user_id)
+            .values(
+                is_blocked=False,
+                blocked_reason=None,
+                blocked_at=None,
+                deviation_score=0.0  # Reset score when unblocking
+            )
+            .returning(User.id)
+        ).first()
+        if not row:
             raise ValueError(f"User {user_id} not found")
         
-        user.is_blocked = False
-        user.blocked_reason = None
-        user.blocked_at = None
-        user.deviation_score = 0.0  # Reset score when unblocking
-        
         self.db.commit()
+        invalidate_analytics_cache()
         
         return {
             "user_id": user_id,
@@ -124,38 +167,41 @@ class AdminService:
     async def assign_task_to_user(self, user_id: int, task_id: int, assigned_by: int) -> UserTask:
         """Assign a task to a user"""
         
-        # Check if assignment already exists
-        existing = self.db.query(UserTask).filter(
-            UserTask.user_id == user_id,
-            UserTask.task_id == task_id
-        ).first()
-        
-        if existing:
-            if not existing.is_active:
-                existing.is_active = True
-                existing.assigned_at = datetime.utcnow()
-                existing.assigned_by = assigned_by
-                self.db.commit()
-                return existing
-            else:
-                raise ValueError("User is already assigned to this task")
-        
-        # Create new assignment
-        user_task = UserTask(
+        # Insert the assignment, or reactivate an inactive one, in a single statement.
+        # An already active assignment matches no row and returns nothing.
+        stmt = pg_insert(UserTask).values(
             user_id=user_id,
             task_id=task_id,
-            assigned_by=assigned_by
-        )
+            assigned_by=assigned_by,
+            is_active=True
+        ).on_conflict_do_update(
+            index_elements=[UserTask.user_id, UserTask.task_id],
+            set_={
+                "is_active": True,
+                "assigned_at": func.now(),
+                "assigned_by": assigned_by
+            },
+            where=UserTask.is_active.isnot(True)
+        ).returning(UserTask)
+        
+        user_task = self.db.scalars(
+            stmt, execution_options={"populate_existing": True}
+        ).first()
+        if user_task is None:
+            raise ValueError("User is already assigned to this task")
         
-        self.db.add(user_task)
         self.db.commit()
-        self.db.refresh(user_task)
         
         return user_task
 
     async def get_usage_analytics(self, days: int = 7) -> Dict[str, Any]:
         """Get system usage analytics"""
         
+        cache_key = _analytics_key("usage", days)
+        cached = _get_cached_analytics(cache_key)
+        if cached is not None:
+            return cached
+        
         since_date = datetime.utcnow() - timedelta(days=days)
         
         # Total requests
@@ -167,10 +213,11 @@ class AdminService:
         ).distinct().count()
         
         # Total tokens used
-        total_tokens = self.db.query(Log).filter(
+        total_tokens = self.db.query(
+            func.coalesce(func.sum(Log.openai_tokens_used), 0)
+        ).filter(
             Log.timestamp >= since_date
-        ).with_entities(Log.openai_tokens_used).all()
-        total_tokens = sum([t[0] for t in total_tokens if t[0] is not None])
+        ).scalar()
         
         # Intent distribution
         intent_data = self.db.query(Log.intent_classification, Log.id).filter(
@@ -189,7 +236,7 @@ class AdminService:
         ).count()
         error_rate = (error_count / total_requests * 100) if total_requests > 0 else 0
         
-        return {
+        result = {
             "analysis_period_days": days,
             "total_requests": total_requests,
             "active_users": active_users,
@@ -199,10 +246,18 @@ class AdminService:
             "intent_distribution": intent_distribution,
             "error_rate_percent": round(error_rate, 2)
         }
+        _store_cached_analytics(cache_key, result)
+        
+        return result
 
     async def get_user_analytics(self) -> Dict[str, Any]:
         """Get user analytics"""
         
+        cache_key = _analytics_key("users")
+        cached = _get_cached_analytics(cache_key)
+        if cached is not None:
+            return cached
+        
         # Total users
         total_users = self.db.query(User).count()
         active_users = self.db.query(User).filter(User.is_active == True).count()
@@ -216,7 +271,7 @@ class AdminService:
         ).count()
         low_risk_users = self.db.query(User).filter(User.deviation_score < 0.5).count()
         
-        return {
+        result = {
             "total_users": total_users,
             "active_users": active_users,
             "blocked_users": blocked_users,
@@ -225,4 +280,7 @@ class AdminService:
                 "medium_risk": medium_risk_users,
                 "low_risk": low_risk_users
             }
-        }
\ No newline at end of file
+        }
+        _store_cached_analytics(cache_key, result)
+        
+        return result
\ No newline at end of file
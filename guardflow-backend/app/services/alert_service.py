@@ -1,14 +1,23 @@
 from sqlalchemy.orm import Session
+from sqlalchemy import func, case
 from typing import List, Optional
 from datetime import datetime, timedelta
 import json
+import threading
 
+from cachetools import TTLCache
+
+from app.database import SessionLocal
 from app.models.alert import Alert, AlertType, AlertStatus
 from app.models.user import User
 from app.models.task import Task
 from app.models.log import Log
 from app.models.chat import Message, Chat
 
+# Per-user 30-day token averages as computed by SQL; the TTL bounds staleness
+_average_tokens_cache: TTLCache = TTLCache(maxsize=10_000, ttl=300)
+_average_tokens_lock = threading.Lock()
+
 
 class AlertService:
     def __init__(self, db: Session):
@@ -47,10 +56,17 @@ class AlertService:
         
         return alert
     
-    def check_suspicious_activity(self, user_id: int, request_tokens: int, task_id: int) -> None:
+    def check_suspicious_activity(
+        self,
+        user_id: int,
+        request_tokens: int,
+        task_id: int,
+        user: Optional[User] = None
+    ) -> None:
         """Check for suspicious patterns and create alerts"""
         
-        user = self.db.query(User).filter(User.id == user_id).first()
+        if user is None:
+            user = self.db.query(User).filter(User.id == user_id).first()
         if not user:
             return
         
@@ -74,13 +90,17 @@ class AlertService:
                 }
             )
         
-        # Check 2: Multiple large requests in short time
-        recent_large_requests = self.db.query(Message).join(Chat).filter(
+        # Hour-window stats for checks 2 and 3 in a single pass over messages
+        recent_large_requests, total_recent_tokens, recent_message_count = self.db.query(
+            func.count(case((Message.tokens_used > 1000, 1))),
+            func.coalesce(func.sum(Message.tokens_used), 0),
+            func.count(Message.id)
+        ).join(Chat).filter(
             Chat.user_id == user_id,
-            Message.created_at >= one_hour_ago,
-            Message.tokens_used > 1000
-        ).count()
+            Message.created_at >= one_hour_ago
+        ).one()
         
+        # Check 2: Multiple large requests in short time
         if recent_large_requests >= 5:
             self.create_alert(
                 user_id=user_id,
@@ -96,12 +116,6 @@ class AlertService:
             )
         
         # Check 3: Rapid token consumption
-        recent_total_tokens = self.db.query(Message).join(Chat).filter(
-            Chat.user_id == user_id,
-            Message.created_at >= one_hour_ago
-        ).with_entities(Message.tokens_used).all()
-        
-        total_recent_tokens = sum(tokens[0] or 0 for tokens in recent_total_tokens)
         if total_recent_tokens > 5000:  # 5K tokens in 1 hour
             self.create_alert(
                 user_id=user_id,
@@ -113,34 +127,49 @@ class AlertService:
                 metadata={
                     "tokens_consumed": total_recent_tokens,
                     "time_window": "1 hour",
-                    "requests_count": len(recent_total_tokens)
+                    "requests_count": recent_message_count
                 }
             )
     
     def _get_user_average_tokens(self, user_id: int) -> float:
         """Calculate user's average tokens per request over last 30 days"""
         
+        with _average_tokens_lock:
+            cached = _average_tokens_cache.get(user_id)
+        if cached is not None:
+            return cached
+        
         thirty_days_ago = datetime.utcnow() - timedelta(days=30)
         
-        # Get tokens from both logs and chat messages
-        log_tokens = self.db.query(Log.openai_tokens_used).filter(
+        # Aggregate tokens from both logs and chat messages in the database
+        log_sum, log_count = self.db.query(
+            func.coalesce(func.sum(Log.openai_tokens_used), 0),
+            func.count(Log.openai_tokens_used)
+        ).filter(
             Log.user_id == user_id,
             Log.timestamp >= thirty_days_ago,
-            Log.openai_tokens_used.isnot(None)
-        ).all()
+            Log.openai_tokens_used > 0
+        ).one()
         
-        chat_tokens = self.db.query(Message.tokens_used).join(Chat).filter(
+        chat_sum, chat_count = self.db.query(
+            func.coalesce(func.sum(Message.tokens_used), 0),
+            func.count(Message.tokens_used)
+        ).join(Chat).filter(
             Chat.user_id == user_id,
             Message.created_at >= thirty_days_ago,
-            Message.tokens_used.isnot(None)
-        ).all()
+            Message.tokens_used > 0
+        ).one()
         
-        all_tokens = [t[0] for t in log_tokens if t[0]] + [t[0] for t in chat_tokens if t[0]]
+        total_count = log_count + chat_count
+        if not total_count:
+            average = 100  # Default for new users
+        else:
+            average = (log_sum + chat_sum) / total_count
         
-        if not all_tokens:
-            return 100  # Default for new users
+        with _average_tokens_lock:
+            _average_tokens_cache[user_id] = average
         
-        return sum(all_tokens) / len(all_tokens)
+        return average
     
     def _auto_block_user(self, user_id: int, reason: str) -> None:
         """Automatically block a user for critical security violations"""
@@ -180,4 +209,14 @@ class AlertService:
         
         return self.db.query(Alert).filter(
             Alert.user_id == user_id
-        ).order_by(Alert.created_at.desc()).limit(limit).all()
\ No newline at end of file
+        ).order_by(Alert.created_at.desc()).limit(limit).all()
+
+
+def check_suspicious_activity_in_background(user_id: int, request_tokens: int, task_id: int) -> None:
+    """Run the suspicious activity checks on a dedicated session (for BackgroundTasks)"""
+    
+    db = SessionLocal()
+    try:
+        AlertService(db).check_suspicious_activity(user_id, request_tokens, task_id)
+    finally:
+        db.close()
\ No newline at end of file
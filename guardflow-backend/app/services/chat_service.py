@@ -1,14 +1,18 @@
-from typing import List, Optional, Dict, Any
-from sqlalchemy.orm import Session
-from sqlalchemy import desc
-from datetime import datetime
+from typing import List, Optional, Dict, Any, AsyncIterator
+from fastapi import BackgroundTasks
+from sqlalchemy.orm import Session, joinedload, raiseload
+from sqlalchemy import desc, tuple_
+from datetime import datetime, timezone
 import uuid
 
+import orjson
+
+from app.core.tokenizer import count_tokens
 from app.models.chat import Chat, Message
 from app.models.user import User
 from app.models.task import Task
-from app.services.alert_service import AlertService
-from app.services.openai_service import OpenAIService
+from app.services.alert_service import AlertService, check_suspicious_activity_in_background
+from app.services.openai_service import OpenAIService, get_openai_service
 from app.schemas.chat import (
     ChatCreateRequest, 
     MessageSendRequest,
@@ -21,8 +25,9 @@ from app.schemas.chat import (
 
 
 class ChatService:
-    def __init__(self, db: Session):
+    def __init__(self, db: Session, openai_service: Optional[OpenAIService] = None):
         self.db = db
+        self.openai_service = openai_service or get_openai_service()
 
     async def create_chat(self, user_id: int, request: ChatCreateRequest) -> ChatResponse:
         """Create a new chat for a specific task (or return existing one)"""
@@ -83,18 +88,46 @@ class ChatService:
     async def get_user_chats(self, user_id: int, task_id: Optional[int] = None) -> List[ChatResponse]:
         """Get all chats for a user, optionally filtered by task"""
         
-        query = self.db.query(Chat).filter(Chat.user_id == user_id, Chat.status == "active")
+        # ChatResponse only reads columns, so no relationship should ever be loaded here
+        query = self.db.query(Chat).options(raiseload("*")).filter(
+            Chat.user_id == user_id,
+            Chat.status == "active"
+        )
         
         if task_id:
             query = query.filter(Chat.task_id == task_id)
             
         chats = query.order_by(desc(Chat.updated_at)).all()
-        return [ChatResponse.model_validate(chat) for chat in chats]
-
-    async def get_chat_with_messages(self, chat_id: uuid.UUID, user_id: int) -> ChatWithMessagesResponse:
-        """Get a specific chat with all its messages"""
         
-        chat = self.db.query(Chat).filter(
+        # Rows come straight from the ORM, so skip per-field validation; title is the
+        # only nullable column behind a non-optional field, so coerce it here instead
+        fields = ChatResponse.model_fields.keys()
+        return [
+            ChatResponse.model_construct(**{
+                **{field: getattr(chat, field) for field in fields},
+                "title": chat.title or ""
+            })
+            for chat in chats
+        ]
+
+    async def get_chat_with_messages(
+        self,
+        chat_id: uuid.UUID,
+        user_id: int,
+        after: Optional[datetime] = None,
+        limit: Optional[int] = None,
+        after_id: Optional[uuid.UUID] = None
+    ) -> ChatWithMessagesResponse:
+        """
+        Get a specific chat with its messages
+        
+        Messages are returned oldest first, ties on `created_at` broken by id. Pass
+        `limit` (and the `created_at` and `id` of the last message seen as `after`
+        and `after_id`) to page through long chats.
+        """
+        
+        # Relationships are never needed for the response, so make lazy loads fail loudly
+        chat = self.db.query(Chat).options(raiseload("*")).filter(
             Chat.id == chat_id,
             Chat.user_id == user_id
         ).first()
@@ -102,9 +135,17 @@ class ChatService:
         if not chat:
             raise ValueError("Chat not found or access denied")
         
-        messages = self.db.query(Message).filter(
-            Message.chat_id == chat_id
-        ).order_by(Message.created_at).all()
+        # Keyset pagination over (chat_id, created_at, id), served by ix_messages_chat_created_id;
+        # a user message and its reply can share a timestamp, so the id breaks the tie
+        query = self.db.query(Message).options(raiseload("*")).filter(Message.chat_id == chat_id)
+        if after is not None:
+            if after_id is None:
+                raise ValueError("after_id is required when paging with after")
+            query = query.filter(tuple_(Message.created_at, Message.id) > (after, after_id))
+        query = query.order_by(Message.created_at, Message.id)
+        if limit is not None:
+            query = query.limit(limit)
+        messages = query.all()
         
         return ChatWithMessagesResponse(
             id=chat.id,
@@ -120,12 +161,86 @@ class ChatService:
     async def send_message(
         self, 
         user_id: int, 
-        request: MessageSendRequest
+        request: MessageSendRequest,
+        background_tasks: Optional[BackgroundTasks] = None
     ) -> SendMessageResponse:
         """Send a message and get AI response (mock for now)"""
         
-        # Verify chat exists and user has access
-        chat = self.db.query(Chat).filter(
+        chat, task, user_message, remaining_tokens, max_response_tokens = self._prepare_message(user_id, request)
+        
+        ai_response = await self.openai_service.generate_response(
+            user_message=request.content,
+            task=task,
+            max_tokens=max_response_tokens,
+            timeout=30
+        )
+        
+        return self._save_exchange(
+            chat, task, user_message, ai_response["content"], ai_response["tokens_used"],
+            remaining_tokens, user_id, background_tasks
+        )
+    
+    async def send_message_stream(
+        self,
+        user_id: int,
+        request: MessageSendRequest,
+        background_tasks: Optional[BackgroundTasks] = None
+    ) -> AsyncIterator[str]:
+        """
+        Send a message and stream the AI response as server-sent events
+        
+        Validation runs before this returns, so quota errors still surface as
+        ValueError. The stream emits `{"delta": ...}` events while the response
+        is generated, then a `done` event carrying the SendMessageResponse once
+        both messages are saved. Errors after the stream has started are sent
+        as an `{"error": ...}` event. If the stream ends early (error or client
+        disconnect), whatever the model produced is still saved and charged.
+        """
+        
+        chat, task, user_message, remaining_tokens, max_response_tokens = self._prepare_message(user_id, request)
+        
+        async def event_stream() -> AsyncIterator[str]:
+            usage: Dict[str, Any] = {}
+            saved = False
+            try:
+                async for delta in self.openai_service.generate_response_stream(
+                    user_message=request.content,
+                    task=task,
+                    max_tokens=max_response_tokens,
+                    timeout=30,
+                    usage=usage
+                ):
+                    yield f"data: {orjson.dumps({'delta': delta}).decode()}\n\n"
+                
+                saved = True
+                response = self._save_exchange(
+                    chat, task, user_message, usage["content"], usage["tokens_used"],
+                    remaining_tokens, user_id, background_tasks
+                )
+                yield f"event: done\ndata: {response.model_dump_json()}\n\n"
+                
+            except Exception as e:
+                yield f"data: {orjson.dumps({'error': {'message': str(e)}}).decode()}\n\n"
+            
+            finally:
+                # Stream cut short after the model started answering: keep the partial
+                # exchange so its tokens count against the task's token_limit
+                if not saved and "tokens_used" in usage:
+                    self._save_exchange(
+                        chat, task, user_message, "".join(usage["parts"]), usage["tokens_used"],
+                        remaining_tokens, user_id, background_tasks
+                    )
+        
+        return event_stream()
+    
+    def _prepare_message(self, user_id: int, request: MessageSendRequest):
+        """Load the chat and enforce token limits before calling the model"""
+        
+        # Verify chat exists and user has access, loading task and user in the same query
+        chat = self.db.query(Chat).options(
+            joinedload(Chat.task),
+            joinedload(Chat.user)
+        ).filter(
             Chat.id == request.chat_id,
             Chat.user_id == user_id
         ).first()
@@ -134,12 +249,12 @@ class ChatService:
             raise ValueError("Chat not found or access denied")
         
         # Get task context
-        task = self.db.query(Task).filter(Task.id == chat.task_id).first()
+        task = chat.task
         if not task:
             raise ValueError("Associated task not found")
         
-        # Estimate tokens for user message (rough estimate: 1 token per 4 characters)
-        user_tokens = max(1, len(request.content) // 4)
+        # Count tokens for user message with the model's tokenizer
+        user_tokens = max(1, count_tokens(request.content, OpenAIService.DEFAULT_MODEL))
         
         # PROTECTION 1: Check per-request token limit (prevent single expensive requests)
         max_request_tokens = task.max_tokens_per_request or 1000
@@ -148,7 +263,7 @@ class ChatService:
         if estimated_total_tokens > max_request_tokens:
             raise ValueError(f"Request too large. Estimated {estimated_total_tokens} tokens, maximum {max_request_tokens} per request.")
         
-        # PROTECTION 2: Check remaining task quota
+        # PROTECTION 2: Check remaining task quota (computed once for the whole request)
         remaining_tokens = task.token_limit - chat.total_tokens_used
         if estimated_total_tokens > remaining_tokens:
             raise ValueError(f"Insufficient tokens. Need ~{estimated_total_tokens}, only {remaining_tokens} remaining.")
@@ -157,70 +272,80 @@ class ChatService:
         if chat.total_tokens_used >= task.token_limit:
             raise ValueError(f"Token limit exceeded. Used: {chat.total_tokens_used}, Limit: {task.token_limit}")
         
-        # Save user message
+        # Build user message (persisted together with the AI response)
         user_message = Message(
             chat_id=request.chat_id,
             content=request.content,
             is_user=True,
             tokens_used=user_tokens,
-            intent=None  # Will be filled by AI response processing
+            intent=None,  # Will be filled by AI response processing
+            created_at=datetime.now(timezone.utc)
         )
-        self.db.add(user_message)
         
-        # Generate AI response using OpenAI service with safety limits
-        openai_service = OpenAIService()
-        remaining_tokens = task.token_limit - chat.total_tokens_used
+        # Safety limit for the AI response
         max_response_tokens = min(
-            (task.max_tokens_per_request or 1000) - user_tokens,  # Subtract user tokens from per-request limit
+            max_request_tokens - user_tokens,  # Subtract user tokens from per-request limit
             remaining_tokens - user_tokens,  # Subtract user tokens from remaining quota
             1000  # Hard limit for safety
         )
         
-        ai_response = await openai_service.generate_response(
-            user_message=request.content,
-            task=task,
-            max_tokens=max_response_tokens,
-            timeout=30
-        )
-        
-        ai_response_content = ai_response["content"]
-        ai_tokens = ai_response["tokens_used"]
+        return chat, task, user_message, remaining_tokens, max_response_tokens
+    
+    def _save_exchange(
+        self,
+        chat: Chat,
+        task: Task,
+        user_message: Message,
+        ai_response_content: str,
+        ai_tokens: int,
+        remaining_tokens: int,
+        user_id: int,
+        background_tasks: Optional[BackgroundTasks]
+    ) -> SendMessageResponse:
+        """Persist the user message and AI response and update chat usage"""
         
-        # Save AI response
+        # Build AI response
         ai_message = Message(
-            chat_id=request.chat_id,
+            chat_id=chat.id,
             content=ai_response_content,
             is_user=False,
             tokens_used=ai_tokens,
-            intent="general_assistance"  # Mock intent for now
+            intent="general_assistance",  # Mock intent for now
+            created_at=datetime.now(timezone.utc)
         )
-        self.db.add(ai_message)
+        
+        # Save both messages in one flush so they go out as a single batched INSERT
+        self.db.add_all([user_message, ai_message])
         
         # Update chat token usage
-        total_tokens_used = user_tokens + ai_tokens
+        total_tokens_used = user_message.tokens_used + ai_tokens
         chat.total_tokens_used += total_tokens_used
-        chat.updated_at = datetime.utcnow()
+        chat.updated_at = datetime.now(timezone.utc)
         
         # Note: We only track task-based token limits, not daily/monthly quotas
         
-        # PROTECTION 4: Check for suspicious activity and create alerts
-        alert_service = AlertService(self.db)
-        alert_service.check_suspicious_activity(user_id, total_tokens_used, task.id)
-        
-        self.db.commit()
-        self.db.refresh(user_message)
-        self.db.refresh(ai_message)
-        self.db.refresh(chat)
-        
-        # Calculate remaining tokens
-        remaining_tokens = max(0, task.token_limit - chat.total_tokens_used)
-        
-        return SendMessageResponse(
+        # Build the response from the flushed objects before commit expires them, so
+        # no post-commit refresh is needed (every response field is set client-side)
+        self.db.flush()
+        response = SendMessageResponse(
             message=MessageResponse.model_validate(user_message),
             response=MessageResponse.model_validate(ai_message),
-            remaining_tokens=remaining_tokens,
+            remaining_tokens=max(0, remaining_tokens - total_tokens_used),
             chat_updated=ChatResponse.model_validate(chat)
         )
+        self.db.commit()
+        
+        # PROTECTION 4: Check for suspicious activity and create alerts.
+        # Alerts are advisory, so when possible they run after the response is sent.
+        if background_tasks is not None:
+            background_tasks.add_task(
+                check_suspicious_activity_in_background, user_id, total_tokens_used, task.id
+            )
+        else:
+            alert_service = AlertService(self.db)
+            alert_service.check_suspicious_activity(user_id, total_tokens_used, task.id, user=chat.user)
+        
+        return response
 
 
     async def get_task_context(self, task_id: int) -> TaskContext:
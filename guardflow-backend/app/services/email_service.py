@@ -3,19 +3,45 @@ Email service for handling invitation and notification emails using SendGrid.
 Supports local development mode with file storage.
 """
 
-from typing import Dict, Any, Optional
-import json
+from typing import Dict, Any, List, Optional
+import asyncio
+import mmap
+from html import escape
 import os
+import threading
 from datetime import datetime
 from pathlib import Path
 
+import httpx
+import orjson
+
 from app.templates.email_templates import (
-    get_invitation_email_template,
-    get_welcome_email_template,
-    get_invitation_reminder_template
+    INVITATION_TEMPLATE,
+    WELCOME_TEMPLATE,
+    INVITATION_REMINDER_TEMPLATE,
+    render_invitations
 )
 from app.core.config import settings
 
+SENDGRID_SEND_URL = "https://api.sendgrid.com/v3/mail/send"
+
+# SendGrid accepts at most 1000 personalizations per Mail
+SENDGRID_MAX_PERSONALIZATIONS = 1000
+
+# Substitution tags for the per-recipient parts of a batched invitation. The HTML
+# body gets its own tags so their values can be HTML-escaped; subject and text don't
+RECIPIENT_EMAIL_TAG = "-recipient_email-"
+INVITATION_LINK_TAG = "-invitation_link-"
+RECIPIENT_EMAIL_HTML_TAG = "-recipient_email_html-"
+INVITATION_LINK_HTML_TAG = "-invitation_link_html-"
+
+# Shared client so bulk sends reuse pooled TLS connections to SendGrid
+_sendgrid_client = httpx.AsyncClient(
+    http2=True,
+    timeout=10,
+    limits=httpx.Limits(max_connections=200, max_keepalive_connections=50)
+)
+
 
 class EmailService:
     """
@@ -28,11 +54,21 @@ class EmailService:
         self.email_dir = Path("emails")
         self.email_dir.mkdir(exist_ok=True)
         
+        # Locally saved emails are appended to a single JSONL file; older
+        # emails may still be stored one per *.json file in the same directory
+        self._log_path = self.email_dir / "emails.jsonl"
+        self._log_lock = threading.Lock()
+        
         # Base URL for invitation links
         self.base_url = getattr(settings, 'BASE_URL', 'https://guardflow.tech')
         
         # Email configuration
         self.use_sendgrid = getattr(settings, 'USE_EXTERNAL_EMAIL', False)
+        
+        # Templates are compiled once at import; sends only substitute fields
+        self._inv_tpl = INVITATION_TEMPLATE
+        self._welcome_tpl = WELCOME_TEMPLATE
+        self._reminder_tpl = INVITATION_REMINDER_TEMPLATE
     
     def send_invitation_email(
         self, 
@@ -69,7 +105,7 @@ class EmailService:
             'expires_in_days': expires_in_days
         }
         
-        template = get_invitation_email_template(email_data)
+        template = self._inv_tpl.render(email_data)
         
         return self._send_email(
             recipient_email=recipient_email,
@@ -78,6 +114,95 @@ class EmailService:
             metadata=email_data
         )
     
+    async def send_bulk_invitations(self, recipients: List[Dict[str, Any]]) -> List[bool]:
+        """
+        Send many invitation emails, one SendGrid request per group of recipients
+        
+        Invitations sharing company, inviter, role and expiry are rendered once and
+        sent as a single Mail with one personalization per recipient (up to
+        SENDGRID_MAX_PERSONALIZATIONS); the recipient email and invitation link are
+        filled in by SendGrid substitution tags, HTML-escaped for the HTML body.
+        
+        Args:
+            recipients: List of dicts with the keyword arguments of send_invitation_email
+                (recipient_email, company_name, inviter_name, role_name,
+                invitation_token and optionally expires_in_days)
+        
+        Returns:
+            list: One bool per recipient, in the same order
+        """
+        
+        # Group by the fields that are rendered into the shared template
+        groups: Dict[tuple, List[int]] = {}
+        for index, recipient in enumerate(recipients):
+            key = (
+                recipient['company_name'],
+                recipient['inviter_name'],
+                recipient['role_name'],
+                recipient.get('expires_in_days', 7)
+            )
+            groups.setdefault(key, []).append(index)
+        
+        results = [False] * len(recipients)
+        batches = []
+        for (company_name, inviter_name, role_name, expires_in_days), indexes in groups.items():
+            common = {
+                'company_name': company_name,
+                'inviter_name': inviter_name,
+                'role_name': role_name,
+                'expires_in_days': expires_in_days
+            }
+            per_recipient = [
+                {
+                    'recipient_email': recipients[i]['recipient_email'],
+                    'invitation_link': f"{self.base_url}/invitation/{recipients[i]['invitation_token']}"
+                }
+                for i in indexes
+            ]
+            
+            if not self.use_sendgrid:
+                for i, fields, template in zip(indexes, per_recipient, render_invitations(common, per_recipient)):
+                    results[i] = self._save_email_locally(fields['recipient_email'], "invitation", template, {**common, **fields})
+                continue
+            
+            template = self._inv_tpl.render({
+                **common,
+                'recipient_email': RECIPIENT_EMAIL_TAG,
+                'invitation_link': INVITATION_LINK_TAG
+            })
+            template['html_body'] = self._inv_tpl.render({
+                **common,
+                'recipient_email': RECIPIENT_EMAIL_HTML_TAG,
+                'invitation_link': INVITATION_LINK_HTML_TAG
+            })['html_body']
+            
+            for start in range(0, len(indexes), SENDGRID_MAX_PERSONALIZATIONS):
+                chunk = slice(start, start + SENDGRID_MAX_PERSONALIZATIONS)
+                personalizations = [
+                    {
+                        "to": [{"email": fields['recipient_email']}],
+                        "substitutions": {
+                            RECIPIENT_EMAIL_TAG: fields['recipient_email'],
+                            INVITATION_LINK_TAG: fields['invitation_link'],
+                            RECIPIENT_EMAIL_HTML_TAG: escape(fields['recipient_email']),
+                            INVITATION_LINK_HTML_TAG: escape(fields['invitation_link'])
+                        }
+                    }
+                    for fields in per_recipient[chunk]
+                ]
+                batches.append((indexes[chunk], template, personalizations))
+        
+        if batches:
+            sent = await asyncio.gather(
+                *[self._send_batch_via_sendgrid_async(template, personalizations) for _, template, personalizations in batches],
+                return_exceptions=True
+            )
+            for (indexes, _, _), success in zip(batches, sent):
+                for i in indexes:
+                    results[i] = success is True
+        
+        return results
+    
     def send_welcome_email(
         self,
         recipient_email: str,
@@ -96,7 +221,7 @@ class EmailService:
             'login_url': login_url
         }
         
-        template = get_welcome_email_template(email_data)
+        template = self._welcome_tpl.render(email_data)
         
         return self._send_email(
             recipient_email=recipient_email,
@@ -124,7 +249,7 @@ class EmailService:
             'days_left': days_left
         }
         
-        template = get_invitation_reminder_template(email_data)
+        template = self._reminder_tpl.render(email_data)
         
         return self._send_email(
             recipient_email=recipient_email,
@@ -158,11 +283,7 @@ class EmailService:
         template: Dict[str, str],
         metadata: Dict[str, Any]
     ) -> bool:
-        """Save email to local file (for development)"""
-        
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        safe_email = recipient_email.replace("@", "_at_").replace(".", "_")
-        filename = f"{timestamp}_{email_type}_{safe_email}.json"
+        """Append email to the local JSONL log (for development)"""
         
         email_record = {
             "timestamp": datetime.now().isoformat(),
@@ -176,10 +297,11 @@ class EmailService:
         }
         
         try:
-            with open(self.email_dir / filename, 'w') as f:
-                json.dump(email_record, f, indent=2, default=str)
+            line = orjson.dumps(email_record, default=str) + b"\n"
+            with self._log_lock, open(self._log_path, "ab") as log:
+                log.write(line)
             
-            print(f"✅ Email saved: {filename}")
+            print(f"✅ Email saved: {self._log_path}")
             print(f"📧 Subject: {template['subject']}")
             print(f"📮 To: {recipient_email}")
             
@@ -190,24 +312,67 @@ class EmailService:
             return False
     
     
-    def get_saved_emails(self, recipient_email: Optional[str] = None) -> list:
-        """Get list of saved emails (for development/testing)"""
+    def get_saved_emails(self, recipient_email: Optional[str] = None, limit: Optional[int] = None) -> list:
+        """Get saved emails, newest first (for development/testing)"""
+        
+        emails = self._read_logged_emails(recipient_email, limit)
+        legacy_emails = self._read_legacy_emails(recipient_email)
+        
+        if legacy_emails:
+            emails.extend(legacy_emails)
+            emails.sort(key=lambda x: x.get('timestamp', ''), reverse=True)
+            if limit is not None:
+                emails = emails[:limit]
+        
+        return emails
+    
+    def _read_logged_emails(self, recipient_email: Optional[str], limit: Optional[int]) -> list:
+        """Read emails from the JSONL log, newest first"""
+        
+        emails = []
+        
+        if not self._log_path.exists() or self._log_path.stat().st_size == 0:
+            return emails
+        
+        # Cheap byte check so non-matching lines are never parsed
+        needle = orjson.dumps(recipient_email) if recipient_email is not None else None
+        
+        # The log is append-only, so walking it backwards yields newest first
+        with open(self._log_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            end = len(mm)
+            while end > 0 and (limit is None or len(emails) < limit):
+                start = mm.rfind(b"\n", 0, end - 1) + 1
+                line = mm[start:end]
+                end = start
+                
+                if needle is not None and needle not in line:
+                    continue
+                
+                try:
+                    email_data = orjson.loads(line)
+                except orjson.JSONDecodeError as e:
+                    print(f"Error reading saved email: {e}")
+                    continue
+                
+                if recipient_email is None or email_data.get('recipient') == recipient_email:
+                    emails.append(email_data)
+        
+        return emails
+    
+    def _read_legacy_emails(self, recipient_email: Optional[str]) -> list:
+        """Read emails saved one per *.json file before the JSONL log"""
         
         emails = []
         
         for email_file in self.email_dir.glob("*.json"):
             try:
-                with open(email_file, 'r') as f:
-                    email_data = json.load(f)
-                    
-                    if recipient_email is None or email_data.get('recipient') == recipient_email:
-                        emails.append(email_data)
-                        
-            except Exception as e:
+                email_data = orjson.loads(email_file.read_bytes())
+            except (OSError, orjson.JSONDecodeError) as e:
                 print(f"Error reading email file {email_file}: {e}")
-        
-        # Sort by timestamp, newest first
-        emails.sort(key=lambda x: x.get('timestamp', ''), reverse=True)
+                continue
+            
+            if recipient_email is None or email_data.get('recipient') == recipient_email:
+                emails.append(email_data)
         
         return emails
     
@@ -266,6 +431,52 @@ class EmailService:
             # Fallback to local storage if SendGrid fails
             return self._save_email_locally(recipient, "sendgrid_error", template, {"error": str(e)})
 
+    
+    async def _send_batch_via_sendgrid_async(self, template: Dict[str, str], personalizations: List[Dict[str, Any]]) -> bool:
+        """Send one SendGrid Mail with a personalization per recipient"""
+        
+        api_key = getattr(settings, 'SENDGRID_API_KEY', '')
+        if not api_key:
+            print("❌ SendGrid API key not configured")
+            return False
+        
+        from_email_addr = getattr(settings, 'FROM_EMAIL', 'admin@guardflow.tech')
+        
+        # SendGrid requires text/plain to come before text/html
+        content = []
+        if template.get('text_body'):
+            content.append({"type": "text/plain", "value": template['text_body']})
+        content.append({"type": "text/html", "value": template['html_body']})
+        
+        payload = {
+            "personalizations": personalizations,
+            "from": {"email": from_email_addr, "name": "Guardflow"},
+            "subject": template['subject'],
+            "content": content,
+            "headers": {"X-Entity-Ref-ID": f"guardflow-{int(datetime.now().timestamp())}"},
+            "categories": ["guardflow", "transactional"]
+        }
+        
+        try:
+            response = await _sendgrid_client.post(
+                SENDGRID_SEND_URL,
+                content=orjson.dumps(payload),
+                headers={"Content-Type": "application/json", "Authorization": f"Bearer {api_key}"}
+            )
+            success = response.status_code == 202
+            
+            if success:
+                print(f"✅ Batch of {len(personalizations)} emails sent via SendGrid")
+            else:
+                print(f"❌ SendGrid batch failed with status: {response.status_code}")
+                print(f"❌ Response body: {response.text}")
+            
+            return success
+            
+        except Exception as e:
+            print(f"❌ SendGrid batch error: {e}")
+            return False
+
 
 # Singleton instance
 email_service = EmailService()
\ No newline at end of file
@@ -0,0 +1,45 @@
+import re
+from typing import Dict, List, Tuple
+
+# Keywords that signal each work intent in a user prompt
+INTENT_KEYWORDS: Dict[str, List[str]] = {
+    "coding": [
+        "code", "coding", "function", "method", "class", "bug", "debug", "debugging",
+        "error", "exception", "traceback", "stack trace", "compile", "refactor",
+        "implement", "api", "endpoint", "variable", "syntax", "algorithm", "regex",
+        "script", "library", "import", "python", "javascript", "typescript", "java", "sql"
+    ],
+    "testing": [
+        "test", "tests", "testing", "unit test", "pytest", "jest", "mock", "mocking",
+        "assert", "assertion", "coverage", "qa", "validate", "validation",
+        "regression", "fixture", "e2e"
+    ],
+    "documentation": [
+        "document", "documentation", "docs", "docstring", "readme", "comment",
+        "comments", "explain", "explanation", "guide", "tutorial", "changelog", "markdown"
+    ],
+    "research": [
+        "research", "compare", "comparison", "difference", "pros and cons",
+        "alternatives", "best practice", "best practices", "benchmark", "analyze",
+        "analysis", "evaluate", "overview", "which is better"
+    ]
+}
+
+_INTENT_PATTERNS = {
+    intent: re.compile(r"\b(?:" + "|".join(re.escape(word) for word in words) + r")\b", re.IGNORECASE)
+    for intent, words in INTENT_KEYWORDS.items()
+}
+
+
+def classify_intent(text: str) -> Tuple[str, float]:
+    """Classify a prompt into a work intent by keyword hits, returning (intent, confidence)"""
+    
+    hits = {intent: len(pattern.findall(text)) for intent, pattern in _INTENT_PATTERNS.items()}
+    total = sum(hits.values())
+    if not total:
+        # Same result as a response without a classification
+        return "unknown", 0.1
+    
+    intent = max(hits, key=hits.get)
+    # Share of the hits, tempered so a single keyword is not full confidence
+    return intent, round(hits[intent] / (total + 1), 2)
@@ -1,20 +1,209 @@
 from typing import List, Dict, Any, Optional
+import asyncio
+import base64
+import os
+import threading
+from contextlib import asynccontextmanager
 from sqlalchemy.orm import Session
 from cryptography.fernet import Fernet
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 import openai
-import json
-import requests
+import httpx
+import orjson
+from cachetools import LRUCache
 
 from app.models import LLMProvider, Tenant
 from app.core.config import settings
 from fastapi import HTTPException
 
+_cipher_suite = Fernet(settings.ENCRYPTION_KEY.encode())
+
+# v2 keys are AES-256-GCM; the AES key is derived from ENCRYPTION_KEY so the
+# Fernet key material is never reused directly for a second algorithm
+API_KEY_V2_PREFIX = "v2:"
+_aesgcm = AESGCM(HKDF(
+    algorithm=hashes.SHA256(),
+    length=32,
+    salt=None,
+    info=b"guardflow-api-key-v2"
+).derive(settings.ENCRYPTION_KEY.encode()))
+
+# Fail fast on unreachable endpoints; reads still get the full budget
+_PROVIDER_TEST_TIMEOUT = httpx.Timeout(10.0, connect=3.0)
+
+# Upper bound on simultaneous connection tests in test_providers_bulk
+PROVIDER_TEST_CONCURRENCY = 8
+
+# Shared client so provider calls reuse pooled, multiplexed HTTP/2 connections
+_http_client = httpx.AsyncClient(
+    http2=True,
+    timeout=httpx.Timeout(30.0, connect=3.0),
+    limits=httpx.Limits(max_keepalive_connections=100)
+)
+
+
+# Decrypted API keys memoized by ciphertext
+_decrypted_keys = LRUCache(maxsize=1024)
+_decrypted_keys_lock = threading.Lock()
+
+
+def _get_cached_api_key(encrypted_key: str) -> Optional[str]:
+    with _decrypted_keys_lock:
+        return _decrypted_keys.get(encrypted_key)
+
+
+def _encrypt_api_key_v2(api_key: str) -> str:
+    """Encrypt an API key as v2:base64(nonce || ciphertext || tag)"""
+    nonce = os.urandom(12)
+    sealed = _aesgcm.encrypt(nonce, api_key.encode(), None)
+    return API_KEY_V2_PREFIX + base64.b64encode(nonce + sealed).decode()
+
+
+def _decrypt_api_key_v2(encrypted_key: str) -> str:
+    raw = base64.b64decode(encrypted_key[len(API_KEY_V2_PREFIX):])
+    return _aesgcm.decrypt(raw[:12], raw[12:], None).decode()
+
+
+def _decrypt_api_key(encrypted_key: str) -> str:
+    """Decrypt a stored API key, memoized by ciphertext"""
+    api_key = _get_cached_api_key(encrypted_key)
+    if api_key is None:
+        if encrypted_key.startswith(API_KEY_V2_PREFIX):
+            api_key = _decrypt_api_key_v2(encrypted_key)
+        else:
+            # Keys stored before v2 are Fernet tokens
+            api_key = _cipher_suite.decrypt(encrypted_key.encode()).decode()
+        with _decrypted_keys_lock:
+            _decrypted_keys[encrypted_key] = api_key
+    return api_key
+
+
+def _pooled_http_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=20)
+    )
+
+
+# Strong references to client close() tasks until they finish
+_closing_clients: set = set()
+# In-flight requests per cached client (by id), and evicted clients waiting for theirs to finish
+_client_leases: Dict[int, int] = {}
+_retired_clients: Dict[int, Any] = {}
+
+
+def _schedule_close(client) -> None:
+    """Close an SDK client's connection pool in the background"""
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        # No loop in this thread; the pool is released when the client is collected
+        return
+    task = loop.create_task(client.close())
+    _closing_clients.add(task)
+    task.add_done_callback(_closing_clients.discard)
+
+
+def _retire_client(client) -> None:
+    """Close a client dropped from the cache once no request is using it (caller holds _clients_lock)"""
+    if _client_leases.get(id(client)):
+        _retired_clients[id(client)] = client
+    else:
+        _schedule_close(client)
+
+
+class _ClientCache(LRUCache):
+    """LRU of SDK clients that retires each client when it is evicted"""
+    
+    def popitem(self):
+        key, client = super().popitem()
+        _retire_client(client)
+        return key, client
+
+
+# One SDK client (and connection pool) per (kind, provider id, key ciphertext, endpoint);
+# keyed by ciphertext so plaintext keys never sit in the cache keys
+_clients = _ClientCache(maxsize=64)
+_clients_lock = threading.Lock()
+
+
+@asynccontextmanager
+async def _leased_client(cache_key: tuple, factory):
+    """Yield the cached client for cache_key, keeping it open until the caller is done with it"""
+    if cache_key[1] is None:
+        # Unsaved providers (e.g. the connection test before create) get a short-lived client
+        client = factory()
+        try:
+            yield client
+        finally:
+            await client.close()
+        return
+    
+    with _clients_lock:
+        client = _clients.get(cache_key)
+        if client is None:
+            client = factory()
+            _clients[cache_key] = client
+        _client_leases[id(client)] = _client_leases.get(id(client), 0) + 1
+    try:
+        yield client
+    finally:
+        with _clients_lock:
+            remaining = _client_leases.pop(id(client)) - 1
+            if remaining:
+                _client_leases[id(client)] = remaining
+            elif id(client) in _retired_clients:
+                _schedule_close(_retired_clients.pop(id(client)))
+
+
+def _openai_client(provider: LLMProvider, api_key: str):
+    """Lease the AsyncOpenAI client (and its connection pool) for a provider key and endpoint"""
+    base_url = provider.api_endpoint or "https://api.openai.com/v1"
+    return _leased_client(
+        ("openai", provider.id, provider.api_key_encrypted, base_url),
+        lambda: openai.AsyncOpenAI(api_key=api_key, base_url=base_url, http_client=_pooled_http_client())
+    )
+
+
+def _azure_openai_client(provider: LLMProvider, api_key: str):
+    """Lease the AsyncAzureOpenAI client (and its connection pool) for a provider key and endpoint"""
+    return _leased_client(
+        ("azure_openai", provider.id, provider.api_key_encrypted, provider.api_endpoint),
+        lambda: openai.AsyncAzureOpenAI(
+            api_key=api_key,
+            api_version="2024-02-15-preview",
+            azure_endpoint=provider.api_endpoint,
+            http_client=_pooled_http_client()
+        )
+    )
+
+
+def discard_provider_clients(provider_id: str) -> None:
+    """Retire cached SDK clients for a provider after its key or endpoint changes or it is deleted"""
+    with _clients_lock:
+        for key in [key for key in _clients if key[1] == provider_id]:
+            _retire_client(_clients.pop(key))
+
+
+async def close_llm_clients() -> None:
+    """Close every cached or retired SDK client and the shared HTTP client (called on shutdown)"""
+    with _clients_lock:
+        # pop() rather than clear(): clear() goes through popitem, which would retire each client again
+        clients = [_clients.pop(key) for key in list(_clients)]
+        clients.extend(_retired_clients.values())
+        _retired_clients.clear()
+    await asyncio.gather(*[client.close() for client in clients], *_closing_clients, return_exceptions=True)
+    await _http_client.aclose()
+
+
 class SimpleLLMRouter:
     """Simple LLM routing service for MVP"""
     
     def __init__(self, db: Session):
         self.db = db
-        self.cipher_suite = Fernet(settings.ENCRYPTION_KEY.encode())
+        self.cipher_suite = _cipher_suite
     
     def get_provider_for_task(self, tenant_id: str, provider_id: str) -> LLMProvider:
         """Get specific provider for a task"""
@@ -43,21 +232,30 @@ class SimpleLLMRouter:
     
     def get_provider_by_model(self, tenant_id: str, model_name: str) -> Optional[LLMProvider]:
         """Find provider that supports a specific model"""
-        providers = self.db.query(LLMProvider).filter(
+        return self.db.query(LLMProvider).filter(
             LLMProvider.tenant_id == tenant_id,
-            LLMProvider.is_active == True
-        ).all()
-        
-        for provider in providers:
-            if model_name in (provider.enabled_models or []):
-                return provider
-        
-        return None
+            LLMProvider.is_active == True,
+            LLMProvider.enabled_models.contains([model_name])
+        ).first()
     
     def decrypt_api_key(self, encrypted_key: str) -> str:
         """Decrypt API key for use"""
         try:
-            return self.cipher_suite.decrypt(encrypted_key.encode()).decode()
+            return _decrypt_api_key(encrypted_key)
+        except Exception as e:
+            raise HTTPException(
+                status_code=500,
+                detail="Failed to decrypt API key"
+            )
+    
+    async def decrypt_api_key_async(self, encrypted_key: str) -> str:
+        """Decrypt API key, running the cipher off the event loop on a cache miss"""
+        api_key = _get_cached_api_key(encrypted_key)
+        if api_key is not None:
+            return api_key
+        
+        try:
+            return await asyncio.to_thread(_decrypt_api_key, encrypted_key)
         except Exception as e:
             raise HTTPException(
                 status_code=500,
@@ -66,19 +264,23 @@ class SimpleLLMRouter:
     
     def encrypt_api_key(self, api_key: str) -> str:
         """Encrypt API key for storage"""
-        return self.cipher_suite.encrypt(api_key.encode()).decode()
+        return _encrypt_api_key_v2(api_key)
     
-    def test_provider_connection(self, provider: LLMProvider) -> Dict[str, Any]:
+    async def encrypt_api_key_async(self, api_key: str) -> str:
+        """Encrypt API key for storage without blocking the event loop"""
+        return await asyncio.to_thread(self.encrypt_api_key, api_key)
+    
+    async def test_provider_connection(self, provider: LLMProvider) -> Dict[str, Any]:
         """Test connection to LLM provider and detect available models"""
-        api_key = self.decrypt_api_key(provider.api_key_encrypted)
+        api_key = await self.decrypt_api_key_async(provider.api_key_encrypted)
         
         try:
             if provider.provider_name == 'openai':
-                return self._test_openai_connection(api_key, provider.api_endpoint)
+                return await self._test_openai_connection(provider, api_key)
             elif provider.provider_name == 'anthropic':
-                return self._test_anthropic_connection(api_key)
+                return await self._test_anthropic_connection(api_key)
             elif provider.provider_name == 'azure_openai':
-                return self._test_azure_openai_connection(api_key, provider.api_endpoint)
+                return await self._test_azure_openai_connection(api_key, provider.api_endpoint)
             else:
                 raise HTTPException(
                     status_code=400,
@@ -91,16 +293,30 @@ class SimpleLLMRouter:
                 "available_models": []
             }
     
-    def _test_openai_connection(self, api_key: str, api_endpoint: Optional[str] = None) -> Dict[str, Any]:
-        """Test OpenAI connection and get models"""
-        client = openai.OpenAI(
-            api_key=api_key,
-            base_url=api_endpoint or "https://api.openai.com/v1"
+    async def test_providers_bulk(self, providers: List[LLMProvider]) -> List[Dict[str, Any]]:
+        """Test several providers concurrently, at most PROVIDER_TEST_CONCURRENCY at a time"""
+        semaphore = asyncio.Semaphore(PROVIDER_TEST_CONCURRENCY)
+        return await asyncio.gather(
+            *[self._test_with_semaphore(provider, semaphore) for provider in providers]
         )
-        
+    
+    async def _test_with_semaphore(self, provider: LLMProvider, semaphore: asyncio.Semaphore) -> Dict[str, Any]:
+        async with semaphore:
+            try:
+                return await self.test_provider_connection(provider)
+            except HTTPException as e:
+                return {
+                    "success": False,
+                    "error": e.detail,
+                    "available_models": []
+                }
+    
+    async def _test_openai_connection(self, provider: LLMProvider, api_key: str) -> Dict[str, Any]:
+        """Test OpenAI connection and get models"""
         try:
             # Get available models
-            models = client.models.list()
+            async with _openai_client(provider, api_key) as client:
+                models = await client.models.list(timeout=_PROVIDER_TEST_TIMEOUT)
             available_models = [model.id for model in models.data 
                              if model.id.startswith(('gpt-', 'text-', 'code-'))]
             
@@ -115,37 +331,25 @@ class SimpleLLMRouter:
                 "available_models": []
             }
     
-    def _test_anthropic_connection(self, api_key: str) -> Dict[str, Any]:
+    async def _test_anthropic_connection(self, api_key: str) -> Dict[str, Any]:
         """Test Anthropic connection"""
         headers = {
             "x-api-key": api_key,
-            "Content-Type": "application/json",
             "anthropic-version": "2023-06-01"
         }
         
-        # Test with a simple completion
-        data = {
-            "model": "claude-3-sonnet-20240229",
-            "max_tokens": 1,
-            "messages": [{"role": "user", "content": "Hi"}]
-        }
-        
         try:
-            response = requests.post(
-                "https://api.anthropic.com/v1/messages",
+            # Listing models verifies the key without a billed completion
+            response = await _http_client.get(
+                "https://api.anthropic.com/v1/models",
                 headers=headers,
-                json=data,
-                timeout=10
+                timeout=_PROVIDER_TEST_TIMEOUT
             )
             
             if response.status_code == 200:
                 return {
                     "success": True,
-                    "available_models": [
-                        "claude-3-sonnet-20240229",
-                        "claude-3-opus-20240229",
-                        "claude-3-haiku-20240307"
-                    ]
+                    "available_models": [model["id"] for model in response.json()["data"]]
                 }
             else:
                 return {
@@ -160,7 +364,7 @@ class SimpleLLMRouter:
                 "available_models": []
             }
     
-    def _test_azure_openai_connection(self, api_key: str, api_endpoint: str) -> Dict[str, Any]:
+    async def _test_azure_openai_connection(self, api_key: str, api_endpoint: str) -> Dict[str, Any]:
         """Test Azure OpenAI connection"""
         if not api_endpoint:
             return {
@@ -170,25 +374,25 @@ class SimpleLLMRouter:
             }
         
         # For Azure OpenAI, models are deployed instances
-        # This is a simplified test - in production you'd query the deployments endpoint
         try:
-            client = openai.AzureOpenAI(
-                api_key=api_key,
-                api_version="2024-02-15-preview",
-                azure_endpoint=api_endpoint
+            response = await _http_client.get(
+                f"{api_endpoint.rstrip('/')}/openai/deployments",
+                params={"api-version": "2022-12-01"},
+                headers={"api-key": api_key},
+                timeout=_PROVIDER_TEST_TIMEOUT
             )
             
-            # Try a simple completion to test connection
-            response = client.chat.completions.create(
-                model="gpt-35-turbo",  # Common deployment name
-                messages=[{"role": "user", "content": "Hi"}],
-                max_tokens=1
-            )
-            
-            return {
-                "success": True,
-                "available_models": ["gpt-35-turbo", "gpt-4"]  # Common deployment names
-            }
+            if response.status_code == 200:
+                return {
+                    "success": True,
+                    "available_models": [deployment["id"] for deployment in response.json()["data"]]
+                }
+            else:
+                return {
+                    "success": False,
+                    "error": f"HTTP {response.status_code}: {response.text}",
+                    "available_models": []
+                }
         except Exception as e:
             return {
                 "success": False,
@@ -196,7 +400,7 @@ class SimpleLLMRouter:
                 "available_models": []
             }
     
-    def make_llm_request(
+    async def make_llm_request(
         self, 
         provider: LLMProvider, 
         messages: List[Dict[str, str]], 
@@ -204,15 +408,15 @@ class SimpleLLMRouter:
         **kwargs
     ) -> Dict[str, Any]:
         """Make request to LLM provider"""
-        api_key = self.decrypt_api_key(provider.api_key_encrypted)
+        api_key = await self.decrypt_api_key_async(provider.api_key_encrypted)
         
         try:
             if provider.provider_name == 'openai':
-                return self._make_openai_request(api_key, provider.api_endpoint, model, messages, **kwargs)
+                return await self._make_openai_request(provider, api_key, model, messages, **kwargs)
             elif provider.provider_name == 'anthropic':
-                return self._make_anthropic_request(api_key, model, messages, **kwargs)
+                return await self._make_anthropic_request(api_key, model, messages, **kwargs)
             elif provider.provider_name == 'azure_openai':
-                return self._make_azure_openai_request(api_key, provider.api_endpoint, model, messages, **kwargs)
+                return await self._make_azure_openai_request(provider, api_key, model, messages, **kwargs)
             else:
                 raise HTTPException(
                     status_code=400,
@@ -224,25 +428,21 @@ class SimpleLLMRouter:
                 detail=f"LLM request failed: {str(e)}"
             )
     
-    def _make_openai_request(
+    async def _make_openai_request(
         self, 
+        provider: LLMProvider, 
         api_key: str, 
-        api_endpoint: Optional[str], 
         model: str, 
         messages: List[Dict[str, str]], 
         **kwargs
     ) -> Dict[str, Any]:
         """Make OpenAI API request"""
-        client = openai.OpenAI(
-            api_key=api_key,
-            base_url=api_endpoint or "https://api.openai.com/v1"
-        )
-        
-        response = client.chat.completions.create(
-            model=model,
-            messages=messages,
-            **kwargs
-        )
+        async with _openai_client(provider, api_key) as client:
+            response = await client.chat.completions.create(
+                model=model,
+                messages=messages,
+                **kwargs
+            )
         
         return {
             "content": response.choices[0].message.content,
@@ -254,7 +454,7 @@ class SimpleLLMRouter:
             "model": response.model
         }
     
-    def _make_anthropic_request(
+    async def _make_anthropic_request(
         self, 
         api_key: str, 
         model: str, 
@@ -275,16 +475,16 @@ class SimpleLLMRouter:
             **{k: v for k, v in kwargs.items() if k != "max_tokens"}
         }
         
-        response = requests.post(
+        response = await _http_client.post(
             "https://api.anthropic.com/v1/messages",
             headers=headers,
-            json=data
+            content=orjson.dumps(data)
         )
         
         if response.status_code != 200:
             raise Exception(f"Anthropic API error: {response.text}")
         
-        result = response.json()
+        result = orjson.loads(response.content)
         
         return {
             "content": result["content"][0]["text"],
@@ -296,26 +496,21 @@ class SimpleLLMRouter:
             "model": model
         }
     
-    def _make_azure_openai_request(
+    async def _make_azure_openai_request(
         self, 
+        provider: LLMProvider, 
         api_key: str, 
-        api_endpoint: str, 
         model: str, 
         messages: List[Dict[str, str]], 
         **kwargs
     ) -> Dict[str, Any]:
         """Make Azure OpenAI API request"""
-        client = openai.AzureOpenAI(
-            api_key=api_key,
-            api_version="2024-02-15-preview",
-            azure_endpoint=api_endpoint
-        )
-        
-        response = client.chat.completions.create(
-            model=model,
-            messages=messages,
-            **kwargs
-        )
+        async with _azure_openai_client(provider, api_key) as client:
+            response = await client.chat.completions.create(
+                model=model,
+                messages=messages,
+                **kwargs
+            )
         
         return {
             "content": response.choices[0].message.content,
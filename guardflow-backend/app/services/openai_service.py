@@ -1,13 +1,17 @@
 import asyncio
 import openai
-from typing import Optional, Dict, Any
+from functools import lru_cache
+from typing import Optional, Dict, Any, AsyncIterator, List
 from datetime import datetime
 import os
 
+from app.core.tokenizer import count_tokens
 from app.models.task import Task
 
 
 class OpenAIService:
+    DEFAULT_MODEL = "gpt-3.5-turbo"  # Use cheaper model by default
+    
     def __init__(self):
         # Get API key from environment - will be None until you set it
         self.api_key = os.getenv("OPENAI_API_KEY")
@@ -56,7 +60,7 @@ class OpenAIService:
             # Make OpenAI API call with timeout and limits
             response = await asyncio.wait_for(
                 self.client.chat.completions.create(
-                    model="gpt-3.5-turbo",  # Use cheaper model by default
+                    model=self.DEFAULT_MODEL,
                     messages=messages,
                     max_tokens=safe_max_tokens,
                     temperature=0.7,
@@ -93,34 +97,101 @@ class OpenAIService:
             print(f"OpenAI error, falling back to mock: {e}")
             return await self._generate_mock_response(user_message, task)
     
-    def _build_system_prompt(self, task: Task) -> str:
-        """Build system prompt based on task context"""
+    async def generate_response_stream(
+        self,
+        user_message: str,
+        task: Task,
+        max_tokens: Optional[int] = None,
+        timeout: int = 30,
+        usage: Optional[Dict[str, Any]] = None
+    ) -> AsyncIterator[str]:
+        """
+        Stream the AI response as content deltas
         
-        base_prompt = f"""You are an AI assistant helping with the task: "{task.title}".
-
-Task Description: {task.description}
-Task Category: {task.category}
-Difficulty Level: {task.difficulty_level}
-
-Guidelines:
-- Stay focused on the assigned task
-- Provide helpful, accurate information
-- Be concise but thorough
-- If the user asks about something outside the task scope, gently redirect them back to the task
-"""
+        Streamed completions carry no usage in this client version, so token
+        counts are kept in `usage` with the model's tokenizer: `tokens_used`
+        covers the prompt once the upstream request is accepted and grows with
+        each delta, and `parts` holds the content received so far, so a stream
+        cut short still reports what was generated. When the stream ends the
+        counts are recomputed and the keys of generate_response are filled in.
+        """
         
-        # Add category-specific instructions
-        if task.category == "coding":
-            base_prompt += "\n- Provide clean, well-commented code examples\n- Explain your reasoning\n- Suggest best practices"
-        elif task.category == "writing":
-            base_prompt += "\n- Help with grammar, style, and structure\n- Provide constructive feedback\n- Suggest improvements"
-        elif task.category == "analysis":
-            base_prompt += "\n- Break down complex problems\n- Provide structured analysis\n- Use data and evidence when possible"
+        if usage is None:
+            usage = {}
+        
+        # If no OpenAI API key, stream the mock response as a single chunk
+        if not self.client or not self.api_key:
+            mock_response = await self._generate_mock_response(user_message, task)
+            usage.update(mock_response, parts=[mock_response["content"]])
+            yield mock_response["content"]
+            return
         
-        # Add token usage awareness
-        base_prompt += f"\n\nToken Management: You have a maximum of {task.max_tokens_per_request or 1000} tokens per response. Be efficient with your words while being helpful."
+        max_request_tokens = task.max_tokens_per_request or 1000
+        safe_max_tokens = min(max_tokens or max_request_tokens, max_request_tokens, 2000)
         
-        return base_prompt
+        messages = [
+            {"role": "system", "content": self._build_system_prompt(task)},
+            {"role": "user", "content": user_message}
+        ]
+        
+        # Approximate chat formatting overhead: 3 tokens per message plus 3 to prime the reply
+        prompt_tokens = sum(count_tokens(m["content"], self.DEFAULT_MODEL) + 3 for m in messages) + 3
+        
+        try:
+            # The timeout bounds the wait for each chunk, not the whole generation
+            stream = await self.client.chat.completions.create(
+                model=self.DEFAULT_MODEL,
+                messages=messages,
+                max_tokens=safe_max_tokens,
+                temperature=0.7,
+                stream=True,
+                user=f"task_{task.id}",
+                timeout=timeout
+            )
+            
+            # The upstream request is billed from here on, even if the client goes away
+            parts: List[str] = []
+            finish_reason = None
+            usage.update(parts=parts, tokens_used=prompt_tokens)
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                choice = chunk.choices[0]
+                if choice.delta.content:
+                    parts.append(choice.delta.content)
+                    usage["tokens_used"] += count_tokens(choice.delta.content, self.DEFAULT_MODEL)
+                    yield choice.delta.content
+                if choice.finish_reason:
+                    finish_reason = choice.finish_reason
+            
+        except openai.APITimeoutError:
+            raise ValueError(f"OpenAI request timed out after {timeout} seconds")
+        except openai.RateLimitError:
+            raise ValueError("OpenAI rate limit exceeded. Please try again later.")
+        except openai.APIError as e:
+            raise ValueError(f"OpenAI API error: {str(e)}")
+        
+        content = "".join(parts)
+        completion_tokens = count_tokens(content, self.DEFAULT_MODEL)
+        
+        usage.update({
+            "content": content,
+            "tokens_used": prompt_tokens + completion_tokens,
+            "model": self.DEFAULT_MODEL,
+            "finish_reason": finish_reason,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens
+        })
+    
+    def _build_system_prompt(self, task: Task) -> str:
+        """Build system prompt based on task context"""
+        return _build_system_prompt_cached(
+            task.title,
+            task.description,
+            task.category,
+            task.difficulty_level,
+            task.max_tokens_per_request
+        )
     
     async def _generate_mock_response(self, user_message: str, task: Task) -> Dict[str, Any]:
         """Generate mock response when OpenAI is not available"""
@@ -145,4 +216,47 @@ Guidelines:
     
     def is_available(self) -> bool:
         """Check if OpenAI API is configured and available"""
-        return self.client is not None and self.api_key is not None
\ No newline at end of file
+        return self.client is not None and self.api_key is not None
+
+
+@lru_cache(maxsize=2048)
+def _build_system_prompt_cached(
+    title: str,
+    description: Optional[str],
+    category: Optional[str],
+    difficulty_level: Optional[str],
+    max_tokens_per_request: Optional[int]
+) -> str:
+    """Build the system prompt for a task; keyed on every field it reads"""
+    
+    base_prompt = f"""You are an AI assistant helping with the task: "{title}".
+
+Task Description: {description}
+Task Category: {category}
+Difficulty Level: {difficulty_level}
+
+Guidelines:
+- Stay focused on the assigned task
+- Provide helpful, accurate information
+- Be concise but thorough
+- If the user asks about something outside the task scope, gently redirect them back to the task
+"""
+    
+    # Add category-specific instructions
+    if category == "coding":
+        base_prompt += "\n- Provide clean, well-commented code examples\n- Explain your reasoning\n- Suggest best practices"
+    elif category == "writing":
+        base_prompt += "\n- Help with grammar, style, and structure\n- Provide constructive feedback\n- Suggest improvements"
+    elif category == "analysis":
+        base_prompt += "\n- Break down complex problems\n- Provide structured analysis\n- Use data and evidence when possible"
+    
+    # Add token usage awareness
+    base_prompt += f"\n\nToken Management: You have a maximum of {max_tokens_per_request or 1000} tokens per response. Be efficient with your words while being helpful."
+    
+    return base_prompt
+
+
+@lru_cache(maxsize=None)
+def get_openai_service() -> OpenAIService:
+    """Shared OpenAIService so its HTTP connection pool is reused across requests"""
+    return OpenAIService()
\ No newline at end of file
@@ -1,20 +1,189 @@
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, AsyncIterator, Tuple
 from sqlalchemy.orm import Session
 import openai
 from openai import AsyncOpenAI
+import asyncio
+import hashlib
+import re
+import httpx
+from functools import lru_cache
 import time
 import uuid
-from datetime import datetime
+from datetime import datetime, timezone
+
+import orjson
+from cachetools import TTLCache
 
 from app.core.config import settings
+from app.core.tokenizer import count_tokens, count_tokens_batch
 from app.models.user import User
 from app.models.task import Task
 from app.models.log import Log
 from app.schemas.proxy import ChatMessage, ChatCompletionResponse, ChatChoice, Usage, MinimalResponse
 from app.services.scoring_service import ScoringService
+from app.services.quota_coalescer import quota_coalescer
+from app.services.intent_classifier import classify_intent
+
+# Configure OpenAI; one HTTP/2 keep-alive pool shared by every ProxyService
+openai_client = AsyncOpenAI(
+    api_key=settings.OPENAI_API_KEY,
+    http_client=httpx.AsyncClient(
+        http2=True,
+        timeout=60.0,
+        limits=httpx.Limits(max_connections=256, max_keepalive_connections=128)
+    )
+)
+
+# Completions currently being fetched, keyed by a hash of (user_id, model, task_id, enhanced messages)
+_inflight: Dict[str, asyncio.Future] = {}
+
+# Recent completions under the same keys; only touched from the event loop
+_response_cache: Optional[TTLCache] = (
+    TTLCache(maxsize=2048, ttl=settings.PROXY_RESPONSE_CACHE_TTL)
+    if settings.PROXY_RESPONSE_CACHE_TTL > 0 else None
+)
+
+
+async def _create_completion_coalesced(key_parts: list, **create_kwargs) -> Tuple[Any, bool]:
+    """
+    Cached, single-flight wrapper around chat.completions.create
+    
+    Returns (response, reused). A repeat of a recent request with the same
+    key_parts reuses its completion when the response cache is enabled, and
+    concurrent calls with identical key_parts share one upstream request; the
+    check-and-insert below has no await in between, so it is atomic on the
+    loop. reused is True whenever this call did not make the upstream request.
+    """
+    key = hashlib.blake2b(orjson.dumps(key_parts, option=orjson.OPT_SORT_KEYS)).hexdigest()
+    
+    if _response_cache is not None:
+        cached = _response_cache.get(key)
+        if cached is not None:
+            return cached, True
+    
+    future = _inflight.get(key)
+    if future is not None:
+        try:
+            return await asyncio.shield(future), True
+        except asyncio.CancelledError:
+            # The leading caller was cancelled rather than us; fetch our own copy
+            if not future.cancelled():
+                raise
+            return await _create_completion_coalesced(key_parts, **create_kwargs)
+    
+    future = asyncio.get_running_loop().create_future()
+    # Mark errors as retrieved so a failure with no followers is not reported as unhandled
+    future.add_done_callback(lambda f: f.cancelled() or f.exception())
+    _inflight[key] = future
+    
+    try:
+        response = await openai_client.chat.completions.create(**create_kwargs)
+        if _response_cache is not None:
+            _response_cache[key] = response
+        future.set_result(response)
+        return response, False
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+    except Exception as e:
+        future.set_exception(e)
+        raise
+    finally:
+        _inflight.pop(key, None)
+
+
+@lru_cache(maxsize=1024)
+def _intent_system_message(
+    title: str,
+    description: Optional[str],
+    allowed_intents_str: str,
+    task_scope: Optional[str],
+    with_intent_instructions: bool = True
+) -> Dict[str, str]:
+    """Render the intent classification system message dict; keyed on every task field it reads"""
+    
+    content = f"""
+You are an AI assistant helping with the task: {title}.
+Task description: {description or 'No description provided'}
+Allowed intents for this task: {allowed_intents_str}
+Task scope: {task_scope or 'No specific scope defined'}
+
+"""
+    
+    if not with_intent_instructions:
+        # Intent is classified locally, so the model only has to answer
+        return {"role": "system", "content": content + "Please answer the user's question thoroughly and helpfully.\n"}
+    
+    content += """Please:
+1. Answer the user's question thoroughly and helpfully
+2. At the very end of your response, add a line starting with "INTENT_CLASSIFICATION:" followed by one of these categories:
+   - coding: Programming, debugging, code review
+   - testing: Writing tests, QA, validation
+   - documentation: Writing docs, comments, explanations
+   - research: Information gathering, analysis
+   - off_topic: Unrelated to the assigned task
+
+Format: INTENT_CLASSIFICATION: [category] | CONFIDENCE: [0.0-1.0]
+
+Example:
+Your main response here...
+
+INTENT_CLASSIFICATION: coding | CONFIDENCE: 0.9
+"""
+    
+    # Already in the wire format, so it is never re-dumped per request
+    return {"role": "system", "content": content}
+
+
+_INTENT_MARKER = "INTENT_CLASSIFICATION:"
+# Matches "<intent> | CONFIDENCE: <float>" right after the marker
+_INTENT_RE = re.compile(r"[ \t]*(\w+)[ \t]*(?:\|[ \t]*CONFIDENCE:[ \t]*([\d.]+))?")
+
+
+def _split_visible(pending: str, at_line_start: bool) -> Tuple[str, str, bool, bool]:
+    """
+    Split buffered stream text into what can be forwarded and what is held back
+    
+    Text is held back while it could still be the start of the trailing intent
+    line. Returns (visible, held, at_line_start, intent_started).
+    """
+    visible = []
+    while pending:
+        if at_line_start:
+            if pending.startswith(_INTENT_MARKER):
+                return "".join(visible), pending, True, True
+            if _INTENT_MARKER.startswith(pending):
+                break
+            at_line_start = False
+        
+        newline = pending.find("\n")
+        if newline == -1:
+            visible.append(pending)
+            pending = ""
+        else:
+            visible.append(pending[:newline + 1])
+            pending = pending[newline + 1:]
+            at_line_start = True
+    
+    return "".join(visible), pending, at_line_start, False
+
+
+def _sse_chunk(request_id: str, created: int, model: str, content: Optional[str] = None, finish_reason: Optional[str] = None, **extra) -> str:
+    """Format one OpenAI-style chat.completion.chunk server-sent event"""
+    chunk = {
+        "id": request_id,
+        "object": "chat.completion.chunk",
+        "created": created,
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "delta": {"content": content} if content is not None else {},
+            "finish_reason": finish_reason
+        }],
+        **extra
+    }
+    return f"data: {orjson.dumps(chunk).decode()}\n\n"
 
-# Configure OpenAI
-openai_client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY)
 
 class ProxyService:
     def __init__(self, db: Session):
@@ -40,24 +209,34 @@ class ProxyService:
         if not task:
             raise ValueError(f"Task {task_id} not found")
         
+        # Field dicts of the (already validated) models
+        message_dicts = [msg.__dict__ for msg in messages]
+        
         # Prepare the enhanced messages with intent classification
-        enhanced_messages = self._add_intent_classification_prompt(messages, task)
+        enhanced_messages = self._add_intent_classification_prompt(message_dicts, task)
         
         try:
-            # Call OpenAI API
-            response = await openai_client.chat.completions.create(
+            # Call OpenAI API; the key covers the rendered system prompt, so task edits
+            # miss the cache, and is per user so completions are never shared across users
+            response, reused = await _create_completion_coalesced(
+                [user.id, model, task_id, enhanced_messages],
                 model=model,
-                messages=[msg.dict() for msg in enhanced_messages],
+                messages=enhanced_messages,
                 temperature=0.7,
                 max_tokens=1000
             )
             
             # Extract response and intent classification
             ai_response = response.choices[0].message.content
-            intent_classification, confidence, clean_response = self._extract_intent_from_response(ai_response)
+            if settings.LOCAL_INTENT_CLASSIFIER:
+                intent_classification, confidence = classify_intent(messages[-1].content)
+                clean_response = ai_response
+            else:
+                intent_classification, confidence, clean_response = self._extract_intent_from_response(ai_response)
             
-            # Calculate response time
-            response_time_ms = int((time.time() - start_time) * 1000)
+            # Calculate response time; one clock read serves every timestamp below
+            finished = time.time()
+            response_time_ms = int((finished - start_time) * 1000)
             
             # Calculate deviation score
             score_before = float(user.deviation_score)
@@ -66,13 +245,12 @@ class ProxyService:
             )
             score_after = score_before + score_delta
             
-            # Update user score and usage
+            # Update user score; token usage is recorded by QuotaTrackingService
             user.deviation_score = score_after
-            user.current_daily_usage += response.usage.total_tokens
-            user.current_monthly_usage += response.usage.total_tokens
-            user.last_activity = datetime.utcnow()
+            user.last_activity = datetime.fromtimestamp(finished, timezone.utc)
             
-            # Log the request
+            # Log the request; a reused completion spent no upstream tokens
+            upstream_usage = None if reused else response.usage
             log_entry = Log(
                 user_id=user.id,
                 task_id=task_id,
@@ -83,9 +261,9 @@ class ProxyService:
                 deviation_score_delta=score_delta,
                 user_score_before=score_before,
                 user_score_after=score_after,
-                openai_tokens_used=response.usage.total_tokens,
-                prompt_tokens=response.usage.prompt_tokens,
-                completion_tokens=response.usage.completion_tokens,
+                openai_tokens_used=upstream_usage.total_tokens if upstream_usage else 0,
+                prompt_tokens=upstream_usage.prompt_tokens if upstream_usage else 0,
+                completion_tokens=upstream_usage.completion_tokens if upstream_usage else 0,
                 response_time_ms=response_time_ms,
                 model=model,
                 ip_address=ip_address,
@@ -95,15 +273,15 @@ class ProxyService:
             )
             
             self.db.add(log_entry)
-            self.db.commit()
             
-            # Check if user should be blocked
+            # Check if user should be blocked; committed together with the score and log
             await self.scoring_service.check_and_block_user(user)
+            self.db.commit()
             
             # Prepare response
             return ChatCompletionResponse(
                 id=request_id,
-                created=int(time.time()),
+                created=int(finished),
                 model=model,
                 choices=[
                     ChatChoice(
@@ -119,7 +297,8 @@ class ProxyService:
                 ),
                 intent_classification=intent_classification,
                 confidence_score=confidence,
-                deviation_score_delta=score_delta
+                deviation_score_delta=score_delta,
+                cached=reused
             )
             
         except Exception as e:
@@ -141,34 +320,19 @@ class ProxyService:
             
             raise e
 
-    def _add_intent_classification_prompt(self, messages: List[ChatMessage], task: Task) -> List[ChatMessage]:
+    def _add_intent_classification_prompt(self, messages: List[Dict[str, str]], task: Task) -> List[Dict[str, str]]:
         """Add intent classification instructions to the messages"""
         
-        # Create system message for intent classification
-        intent_system_msg = f"""
-You are an AI assistant helping with the task: {task.name}.
-Task description: {task.description or 'No description provided'}
-Allowed intents for this task: {', '.join(task.allowed_intents) if task.allowed_intents else 'Any'}
-Task scope: {task.task_scope or 'No specific scope defined'}
-
-Please:
-1. Answer the user's question thoroughly and helpfully
-2. At the very end of your response, add a line starting with "INTENT_CLASSIFICATION:" followed by one of these categories:
-   - coding: Programming, debugging, code review
-   - testing: Writing tests, QA, validation
-   - documentation: Writing docs, comments, explanations
-   - research: Information gathering, analysis
-   - off_topic: Unrelated to the assigned task
-
-Format: INTENT_CLASSIFICATION: [category] | CONFIDENCE: [0.0-1.0]
-
-Example:
-Your main response here...
-
-INTENT_CLASSIFICATION: coding | CONFIDENCE: 0.9
-"""
+        # The system message goes first so the shared prefix is eligible for prompt caching
+        intent_system_msg = _intent_system_message(
+            task.title,
+            task.description,
+            task.allowed_intents_str,
+            task.task_scope,
+            not settings.LOCAL_INTENT_CLASSIFIER
+        )
         
-        enhanced_messages = [ChatMessage(role="system", content=intent_system_msg)]
+        enhanced_messages = [intent_system_msg]
         enhanced_messages.extend(messages)
         
         return enhanced_messages
@@ -176,37 +340,26 @@ INTENT_CLASSIFICATION: coding | CONFIDENCE: 0.9
     def _extract_intent_from_response(self, response: str) -> tuple[str, float, str]:
         """Extract intent classification from OpenAI response"""
         
-        lines = response.strip().split('\n')
-        intent_line = None
-        clean_response = response
+        # The marker line comes last, so search from the end without splitting lines
+        idx = response.rfind(_INTENT_MARKER)
+        if idx < 0:
+            # No intent classification found
+            return "unknown", 0.1, response
         
-        # Look for intent classification line
-        for i, line in enumerate(lines):
-            if line.startswith("INTENT_CLASSIFICATION:"):
-                intent_line = line
-                # Remove the intent line from the response
-                clean_response = '\n'.join(lines[:i]).strip()
-                break
+        # Remove the intent line from the response
+        clean_response = response[:idx].strip()
         
-        if intent_line:
-            try:
-                # Parse intent and confidence
-                parts = intent_line.replace("INTENT_CLASSIFICATION:", "").strip().split("|")
-                intent = parts[0].strip()
-                confidence = 0.5  # default
-                
-                if len(parts) > 1 and "CONFIDENCE:" in parts[1]:
-                    confidence_str = parts[1].replace("CONFIDENCE:", "").strip()
-                    confidence = float(confidence_str)
-                
-                return intent, confidence, clean_response
-                
-            except Exception as e:
-                # Fallback if parsing fails
-                return "unknown", 0.1, clean_response
+        match = _INTENT_RE.match(response, idx + len(_INTENT_MARKER))
+        if not match:
+            # Fallback if parsing fails
+            return "unknown", 0.1, clean_response
+        
+        try:
+            confidence = float(match.group(2)) if match.group(2) else 0.5  # default
+        except ValueError:
+            return "unknown", 0.1, clean_response
         
-        # No intent classification found
-        return "unknown", 0.1, clean_response
+        return match.group(1), confidence, clean_response
     
     async def process_simple_request(
         self,
@@ -232,7 +385,7 @@ INTENT_CLASSIFICATION: coding | CONFIDENCE: 0.9
             # Call OpenAI API directly (no intent classification)
             response = await openai_client.chat.completions.create(
                 model=model,
-                messages=[msg.dict() for msg in messages],
+                messages=[msg.__dict__ for msg in messages],
                 temperature=0.7,
                 max_tokens=1000
             )
@@ -240,10 +393,11 @@ INTENT_CLASSIFICATION: coding | CONFIDENCE: 0.9
             # Extract response data
             response_content = response.choices[0].message.content
             tokens_used = response.usage.total_tokens
-            response_time_ms = int((time.time() - start_time) * 1000)
+            finished = time.time()
+            response_time_ms = int((finished - start_time) * 1000)
             
-            # Create minimal log entry for dummy tasks
-            log_entry = Log(
+            # Queue minimal log entry for dummy tasks (written in the next batch)
+            quota_coalescer.add_log(dict(
                 user_id=user.id,
                 task_id=task_id,
                 tenant_id=user.tenant_id,
@@ -256,17 +410,14 @@ INTENT_CLASSIFICATION: coding | CONFIDENCE: 0.9
                 intent_classification="api_access",  # Special intent for dummy tasks
                 confidence_score=1.0,
                 deviation_score_delta=0.0,  # No deviation scoring for dummy tasks
-                timestamp=datetime.utcnow()
-            )
-            
-            self.db.add(log_entry)
-            self.db.commit()
+                timestamp=datetime.fromtimestamp(finished, timezone.utc)
+            ))
             
             # Prepare response
             chat_response = ChatCompletionResponse(
                 id=request_id,
                 object="chat.completion",
-                created=int(time.time()),
+                created=int(finished),
                 model=model,
                 choices=[
                     ChatChoice(
@@ -286,7 +437,8 @@ INTENT_CLASSIFICATION: coding | CONFIDENCE: 0.9
             
         except Exception as e:
             # Log error for dummy tasks
-            response_time_ms = int((time.time() - start_time) * 1000)
+            finished = time.time()
+            response_time_ms = int((finished - start_time) * 1000)
             
             error_log = Log(
                 user_id=user.id,
@@ -301,10 +453,261 @@ INTENT_CLASSIFICATION: coding | CONFIDENCE: 0.9
                 intent_classification="api_access",
                 confidence_score=0.0,
                 deviation_score_delta=0.0,
-                timestamp=datetime.utcnow()
+                timestamp=datetime.fromtimestamp(finished, timezone.utc)
             )
             
             self.db.add(error_log)
             self.db.commit()
             
-            raise Exception(f"OpenAI API error in dummy task: {str(e)}")
\ No newline at end of file
+            raise Exception(f"OpenAI API error in dummy task: {str(e)}")
+    
+    async def _stream_completion(
+        self,
+        model: str,
+        messages: List[Dict[str, str]],
+        usage: Dict[str, Any]
+    ) -> AsyncIterator[str]:
+        """
+        Stream content deltas from OpenAI
+        
+        Streamed completions carry no usage in this client version, so token
+        counts (plus the content parts and finish_reason) are kept in `usage`
+        with the model's tokenizer: the prompt once the upstream request is
+        accepted and each delta as it arrives, so a stream cut short still
+        reports what was generated. They are recomputed over the full content
+        when the stream ends.
+        """
+        stream = await openai_client.chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=0.7,
+            max_tokens=1000,
+            stream=True
+        )
+        
+        # The upstream request is billed from here on, even if the client goes away
+        prompt_tokens = sum(count_tokens_batch([msg["content"] for msg in messages], model))
+        parts: List[str] = []
+        usage.update(
+            parts=parts,
+            finish_reason=None,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=0,
+            total_tokens=prompt_tokens
+        )
+        
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            choice = chunk.choices[0]
+            if choice.delta.content:
+                parts.append(choice.delta.content)
+                usage["completion_tokens"] += count_tokens(choice.delta.content, model)
+                usage["total_tokens"] = prompt_tokens + usage["completion_tokens"]
+                yield choice.delta.content
+            if choice.finish_reason:
+                usage["finish_reason"] = choice.finish_reason
+        
+        completion_tokens = count_tokens("".join(parts), model)
+        usage.update(
+            completion_tokens=completion_tokens,
+            total_tokens=prompt_tokens + completion_tokens
+        )
+    
+    def process_request_stream(
+        self,
+        user: User,
+        task_id: int,
+        messages: List[ChatMessage],
+        model: str = "gpt-3.5-turbo",
+        ip_address: str = "",
+        user_agent: str = "",
+        usage: Optional[Dict[str, Any]] = None
+    ) -> AsyncIterator[str]:
+        """
+        Streaming variant of process_request, yielding OpenAI-style SSE chunks
+        
+        Content is forwarded as it arrives, minus the trailing intent line. The
+        last chunk carries usage and the Guardflow fields. The score update, log
+        write and block check run when the stream closes, however it closes, so
+        a client that disconnects early is still scored on what it received.
+        """
+        
+        # Validation runs before this returns, so a missing task still raises here
+        task = self.db.query(Task).filter(Task.id == task_id).first()
+        if not task:
+            raise ValueError(f"Task {task_id} not found")
+        
+        message_dicts = [msg.__dict__ for msg in messages]
+        enhanced_messages = self._add_intent_classification_prompt(message_dicts, task)
+        if usage is None:
+            usage = {}
+        
+        async def event_stream() -> AsyncIterator[str]:
+            start_time = time.time()
+            created = int(start_time)
+            request_id = str(uuid.uuid4())
+            scored: Optional[Tuple[str, float, str, float]] = None
+            error_message = "Client disconnected before the stream finished"
+            
+            try:
+                pending, at_line_start, intent_started = "", True, False
+                async for delta in self._stream_completion(model, enhanced_messages, usage):
+                    if intent_started:
+                        continue
+                    visible, pending, at_line_start, intent_started = _split_visible(pending + delta, at_line_start)
+                    if visible:
+                        yield _sse_chunk(request_id, created, model, visible)
+                
+                if pending and not intent_started:
+                    yield _sse_chunk(request_id, created, model, pending)
+                
+                scored = await self._score_stream(user, task, messages, usage)
+                intent_classification, confidence, _, score_delta = scored
+                error_message = None
+                
+                yield _sse_chunk(
+                    request_id, created, model,
+                    finish_reason=usage["finish_reason"],
+                    usage={
+                        "prompt_tokens": usage["prompt_tokens"],
+                        "completion_tokens": usage["completion_tokens"],
+                        "total_tokens": usage["total_tokens"]
+                    },
+                    intent_classification=intent_classification,
+                    confidence_score=confidence,
+                    deviation_score_delta=score_delta
+                )
+                yield "data: [DONE]\n\n"
+                
+            except Exception as e:
+                error_message = str(e)
+                yield f"data: {orjson.dumps({'error': {'message': error_message}}).decode()}\n\n"
+            
+            finally:
+                # Runs on completion, error, disconnect and cancellation alike. Nothing
+                # below suspends (the scoring coroutines only touch the sync session),
+                # so it completes even while the task is being cancelled.
+                finished = time.time()
+                log_row = dict(
+                    user_id=user.id,
+                    task_id=task_id,
+                    prompt=messages[-1].content,
+                    model=model,
+                    ip_address=ip_address,
+                    user_agent=user_agent,
+                    request_id=request_id,
+                    response_time_ms=int((finished - start_time) * 1000),
+                    timestamp=datetime.fromtimestamp(finished, timezone.utc)
+                )
+                
+                if "total_tokens" in usage:
+                    # The model produced output, so the request counts towards the score
+                    if scored is None:
+                        scored = await self._score_stream(user, task, messages, usage)
+                    intent_classification, confidence, clean_response, score_delta = scored
+                    
+                    score_before = float(user.deviation_score)
+                    score_after = score_before + score_delta
+                    user.deviation_score = score_after
+                    user.last_activity = log_row["timestamp"]
+                    await self.scoring_service.check_and_block_user(user)
+                    self.db.commit()
+                    
+                    log_row.update(
+                        response=clean_response,
+                        intent_classification=intent_classification,
+                        confidence_score=confidence,
+                        deviation_score_delta=score_delta,
+                        user_score_before=score_before,
+                        user_score_after=score_after,
+                        openai_tokens_used=usage["total_tokens"],
+                        prompt_tokens=usage["prompt_tokens"],
+                        completion_tokens=usage["completion_tokens"]
+                    )
+                
+                if error_message is None:
+                    log_row["status"] = "success"
+                else:
+                    log_row.update(status="error", error_message=error_message)
+                quota_coalescer.add_log(log_row)
+        
+        return event_stream()
+    
+    async def _score_stream(
+        self,
+        user: User,
+        task: Task,
+        messages: List[ChatMessage],
+        usage: Dict[str, Any]
+    ) -> Tuple[str, float, str, float]:
+        """Classify the streamed content and score it; returns (intent, confidence, clean response, score delta)"""
+        
+        content = "".join(usage["parts"])
+        if settings.LOCAL_INTENT_CLASSIFIER:
+            intent_classification, confidence = classify_intent(messages[-1].content)
+            clean_response = content
+        else:
+            intent_classification, confidence, clean_response = self._extract_intent_from_response(content)
+        
+        score_delta = await self.scoring_service.calculate_deviation_score(
+            user, task, intent_classification, confidence
+        )
+        return intent_classification, confidence, clean_response, score_delta
+    
+    async def process_simple_request_stream(
+        self,
+        user: User,
+        task_id: int,
+        messages: List[ChatMessage],
+        model: str = "gpt-3.5-turbo",
+        usage: Optional[Dict[str, Any]] = None
+    ) -> AsyncIterator[str]:
+        """Streaming variant of process_simple_request, yielding OpenAI-style SSE chunks"""
+        
+        if usage is None:
+            usage = {}
+        
+        start_time = time.time()
+        created = int(start_time)
+        request_id = str(uuid.uuid4())
+        error_message = "Client disconnected before the stream finished"
+        
+        try:
+            async for delta in self._stream_completion(model, [msg.__dict__ for msg in messages], usage):
+                yield _sse_chunk(request_id, created, model, delta)
+            
+            error_message = None
+            yield _sse_chunk(
+                request_id, created, model,
+                finish_reason=usage["finish_reason"],
+                usage={
+                    "prompt_tokens": usage["prompt_tokens"],
+                    "completion_tokens": usage["completion_tokens"],
+                    "total_tokens": usage["total_tokens"]
+                }
+            )
+            yield "data: [DONE]\n\n"
+            
+        except Exception as e:
+            error_message = str(e)
+            yield f"data: {orjson.dumps({'error': {'message': error_message}}).decode()}\n\n"
+        
+        finally:
+            # Logged however the stream ends, with whatever tokens were generated
+            finished = time.time()
+            quota_coalescer.add_log(dict(
+                user_id=user.id,
+                task_id=task_id,
+                tenant_id=user.tenant_id,
+                request_id=request_id,
+                prompt="[DUMMY_TASK_REQUEST]",  # Don't store full prompt for privacy
+                response="[DUMMY_TASK_RESPONSE]" if error_message is None else f"[ERROR: {error_message}]",
+                openai_tokens_used=usage.get("total_tokens", 0),
+                response_time_ms=int((finished - start_time) * 1000),
+                status="success" if error_message is None else "error",
+                intent_classification="api_access",
+                confidence_score=1.0 if error_message is None else 0.0,
+                deviation_score_delta=0.0,
+                timestamp=datetime.fromtimestamp(finished, timezone.utc)
+            ))
\ No newline at end of file
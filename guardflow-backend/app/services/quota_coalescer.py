@@ -0,0 +1,171 @@
+import asyncio
+import logging
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import update, func
+
+from app.database import SessionLocal
+from app.models.user import User
+from app.models.log import Log
+from app.models.user_task import UserTask
+
+logger = logging.getLogger(__name__)
+
+
+class QuotaCoalescer:
+    """
+    Write-behind buffer for hot-path usage writes
+    
+    Token usage increments and log rows are queued by request handlers and
+    written by a background worker every FLUSH_INTERVAL seconds (or MAX_BATCH
+    items), one transaction per batch. Increments for the same user are summed
+    and applied as a single atomic UPDATE. A batch that fails is retried, then
+    written item by item so one bad row cannot drop the rest.
+    """
+    
+    FLUSH_INTERVAL = 0.05
+    MAX_BATCH = 128
+    MAX_RETRIES = 3
+    RETRY_DELAY = 0.5
+    
+    def __init__(self):
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+    
+    def add_usage(self, user_id: int, tokens_used: int) -> None:
+        """Queue a token usage increment for a user"""
+        self._submit(("usage", user_id, tokens_used))
+    
+    def add_task_usage(self, user_task_id: int, tokens_used: int) -> None:
+        """Queue a token usage increment for a user task"""
+        self._submit(("task_usage", user_task_id, tokens_used))
+    
+    def add_log(self, row: Dict[str, Any]) -> None:
+        """Queue a Log row (column name -> value) for insertion"""
+        self._submit(("log", row))
+    
+    async def drain(self) -> None:
+        """Flush everything queued so far, including the worker's in-flight batch (called on shutdown)"""
+        if self._worker is not None and not self._worker.done():
+            # Stop marker rather than cancel(): the worker flushes the batch it holds, then exits
+            self._queue.put_nowait(None)
+            await self._worker
+        self._worker = None
+        
+        batch = []
+        while self._queue is not None and not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is not None:
+                batch.append(item)
+        
+        if batch:
+            await self._flush_with_retry(batch)
+    
+    def _submit(self, item: Tuple) -> None:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Called from a worker thread (sync route): write through immediately
+            self._flush([item])
+            return
+        
+        if self._worker is None or self._worker.done():
+            if self._queue is None:
+                self._queue = asyncio.Queue()
+            self._worker = loop.create_task(self._run())
+        
+        self._queue.put_nowait(item)
+    
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is None:
+                return
+            
+            batch = [item]
+            deadline = loop.time() + self.FLUSH_INTERVAL
+            
+            while len(batch) < self.MAX_BATCH:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            
+            await self._flush_with_retry(batch)
+    
+    async def _flush_with_retry(self, batch: List[Tuple]) -> None:
+        for attempt in range(1, self.MAX_RETRIES + 1):
+            try:
+                await asyncio.to_thread(self._flush, batch)
+                return
+            except Exception as e:
+                logger.warning(f"Error flushing {len(batch)} queued usage writes (attempt {attempt}): {e}")
+                if attempt < self.MAX_RETRIES:
+                    await asyncio.sleep(self.RETRY_DELAY * attempt)
+        
+        # Still failing: write items one by one so only the bad ones are lost
+        for item in batch:
+            try:
+                await asyncio.to_thread(self._flush, [item])
+            except Exception as e:
+                logger.error(f"Dropping queued {item[0]} write: {e}")
+    
+    def _flush(self, batch: List[Tuple]) -> None:
+        usage: Dict[int, int] = defaultdict(int)
+        task_usage: Dict[int, int] = defaultdict(int)
+        logs: List[Dict[str, Any]] = []
+        
+        for item in batch:
+            if item[0] == "usage":
+                usage[item[1]] += item[2]
+            elif item[0] == "task_usage":
+                task_usage[item[1]] += item[2]
+            else:
+                logs.append(item[1])
+        
+        db = SessionLocal()
+        try:
+            for user_id, tokens_used in usage.items():
+                db.execute(
+                    update(User)
+                    .where(User.id == user_id)
+                    .values(
+                        current_daily_usage=User.current_daily_usage + tokens_used,
+                        current_monthly_usage=User.current_monthly_usage + tokens_used,
+                        last_activity=func.now()
+                    )
+                    .execution_options(synchronize_session=False)
+                )
+            
+            for user_task_id, tokens_used in task_usage.items():
+                db.execute(
+                    update(UserTask)
+                    .where(UserTask.id == user_task_id)
+                    .values(tokens_used=UserTask.tokens_used + tokens_used)
+                    .execution_options(synchronize_session=False)
+                )
+            
+            if logs:
+                db.bulk_insert_mappings(Log, logs)
+            
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+
+# Global instance shared by request handlers
+quota_coalescer = QuotaCoalescer()
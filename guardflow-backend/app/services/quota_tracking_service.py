@@ -1,25 +1,145 @@
 from sqlalchemy.orm import Session
-from typing import Optional
+from sqlalchemy import update, func
+from typing import List, Optional, Tuple
 from datetime import datetime, timezone
+from redis import Redis
 import logging
 
-from app.models import User, Task, UserTask
+from app.models import User, Task, UserTask, Log
+from app.services.quota_coalescer import quota_coalescer
 
 logger = logging.getLogger(__name__)
 
+DAILY_KEY_TTL = 172800  # 2 days
+MONTHLY_KEY_TTL = 35 * 86400
+
+# Seeds missing counters, then either rejects (returning the 1-based index of
+# the first counter that would exceed its limit and its current value) or
+# increments every counter and returns 0 followed by the new values. A seed of
+# -1 means "not loaded": if such a counter is missing the script changes
+# nothing and returns {-1} so the caller can load the seeds and run it again.
+# KEYS: counter keys, all hash-tagged to the same user so they share a cluster
+# slot; ARGV: amount, then (seed, limit, ttl) per key.
+_RESERVE_SCRIPT = """
+local amount = tonumber(ARGV[1])
+for i, key in ipairs(KEYS) do
+    if tonumber(ARGV[2 + (i - 1) * 3]) < 0 and redis.call('EXISTS', key) == 0 then
+        return {-1}
+    end
+end
+for i, key in ipairs(KEYS) do
+    local base = 1 + (i - 1) * 3
+    local ttl = tonumber(ARGV[base + 3])
+    if tonumber(ARGV[base + 1]) >= 0 and redis.call('SET', key, ARGV[base + 1], 'NX') and ttl > 0 then
+        redis.call('EXPIRE', key, ttl)
+    end
+    local limit = tonumber(ARGV[base + 2])
+    local used = tonumber(redis.call('GET', key))
+    if limit > 0 and used + amount > limit then
+        return {i, used}
+    end
+end
+local result = {0}
+for i, key in ipairs(KEYS) do
+    result[i + 1] = redis.call('INCRBY', key, amount)
+end
+return result
+"""
+
 
 class QuotaTrackingService:
     """Service for handling quota tracking for both regular and dummy tasks"""
     
-    def __init__(self, db: Session):
+    def __init__(self, db: Session, redis: Redis):
         self.db = db
+        self.redis = redis
+        self._reserve = redis.register_script(_RESERVE_SCRIPT)
+    
+    # Keys carry the user id as a {hash tag} so one user's counters land in the
+    # same Redis Cluster slot and the reserve script can touch them together
+    
+    @staticmethod
+    def _daily_key(user_id: int, now: datetime) -> str:
+        return f"quota:{{u:{user_id}}}:d:{now:%Y%m%d}"
+    
+    @staticmethod
+    def _monthly_key(user_id: int, now: datetime) -> str:
+        return f"quota:{{u:{user_id}}}:m:{now:%Y%m}"
+    
+    @staticmethod
+    def _task_key(user_id: int, user_task_id: int) -> str:
+        return f"quota:{{u:{user_id}}}:ut:{user_task_id}"
+    
+    def _counters(
+        self,
+        user: User,
+        task: Task,
+        user_task: Optional[UserTask],
+        now: datetime
+    ) -> List[Tuple[str, int, int, int]]:
+        """
+        Counter (key, seed, limit, ttl) tuples: daily, monthly, then task if tracked
+        
+        The daily and monthly seeds are -1 (not loaded); see _load_seeds.
+        """
+        counters = [
+            (self._daily_key(user.id, now), -1, user.daily_quota, DAILY_KEY_TTL),
+            (self._monthly_key(user.id, now), -1, user.monthly_quota, MONTHLY_KEY_TTL)
+        ]
+        if not task.is_dummy_task and user_task:
+            counters.append((self._task_key(user.id, user_task.id), user_task.tokens_used, task.token_limit, 0))
+        return counters
+    
+    def _load_seeds(self, user: User, now: datetime, counters: List[Tuple[str, int, int, int]]) -> List[Tuple[str, int, int, int]]:
+        """Fill in the daily and monthly seeds with the tokens logged so far this day and month"""
+        day_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        month_start = day_start.replace(day=1)
+        
+        # One pass over the user's logs for the month, served by ix_logs_user_ts
+        daily, monthly = self.db.query(
+            func.coalesce(func.sum(Log.openai_tokens_used).filter(Log.timestamp >= day_start), 0),
+            func.coalesce(func.sum(Log.openai_tokens_used), 0)
+        ).filter(
+            Log.user_id == user.id,
+            Log.timestamp >= month_start
+        ).one()
+        
+        (daily_key, _, daily_limit, daily_ttl), (monthly_key, _, monthly_limit, monthly_ttl) = counters[:2]
+        return [
+            (daily_key, int(daily), daily_limit, daily_ttl),
+            (monthly_key, int(monthly), monthly_limit, monthly_ttl)
+        ] + counters[2:]
+    
+    def _run_reserve(
+        self,
+        user: User,
+        task: Task,
+        user_task: Optional[UserTask],
+        amount: int,
+        enforce_limits: bool = True
+    ) -> List[int]:
+        now = datetime.now(timezone.utc)
+        counters = self._counters(user, task, user_task, now)
+        
+        def run(counters):
+            args = [amount]
+            for _, seed, limit, ttl in counters:
+                args.extend((seed, limit if enforce_limits else 0, ttl))
+            return [int(v) for v in self._reserve(keys=[c[0] for c in counters], args=args)]
+        
+        result = run(counters)
+        if result[0] == -1:
+            # First request of the period (or Redis lost the counter): seed from the logs
+            result = run(self._load_seeds(user, now, counters))
+        return result
     
     def update_task_usage(
         self, 
         user: User, 
         task: Task, 
         tokens_used: int,
-        user_task: Optional[UserTask] = None
+        user_task: Optional[UserTask] = None,
+        reserved_tokens: int = 0
     ) -> dict:
         """
         Update usage tracking for both regular and dummy tasks
@@ -27,39 +147,53 @@ class QuotaTrackingService:
         For dummy tasks: Updates user quotas directly
         For regular tasks: Updates both task usage and user quotas
         
+        reserved_tokens is the estimate already counted by check_quotas_before_request;
+        only the difference is applied to the Redis counters.
+        
         Returns updated quota info
         """
         try:
+            values = self._run_reserve(user, task, user_task, tokens_used - reserved_tokens, enforce_limits=False)[1:]
+            
+            # Persist the totals to Postgres off the request path
+            quota_coalescer.add_usage(user.id, tokens_used)
+            
             if task.is_dummy_task:
-                return self._update_dummy_task_usage(user, task, tokens_used)
+                return self._update_dummy_task_usage(user, task, tokens_used, values)
             else:
-                return self._update_regular_task_usage(user, task, tokens_used, user_task)
+                return self._update_regular_task_usage(user, task, tokens_used, user_task, values)
         except Exception as e:
             logger.error(f"Error updating task usage: {e}")
             raise
     
-    def _update_dummy_task_usage(self, user: User, task: Task, tokens_used: int) -> dict:
+    def release_reservation(
+        self,
+        user: User,
+        task: Task,
+        reserved_tokens: int,
+        user_task: Optional[UserTask] = None
+    ) -> None:
+        """Give back tokens reserved by check_quotas_before_request for a failed request"""
+        try:
+            self._run_reserve(user, task, user_task, -reserved_tokens, enforce_limits=False)
+        except Exception as e:
+            logger.error(f"Error releasing reserved tokens for user {user.id}: {e}")
+    
+    def _update_dummy_task_usage(self, user: User, task: Task, tokens_used: int, values: List[int]) -> dict:
         """Update usage for dummy tasks - only user quotas"""
         
-        # Update user's daily and monthly usage
-        user.current_daily_usage = (user.current_daily_usage or 0) + tokens_used
-        user.current_monthly_usage = (user.current_monthly_usage or 0) + tokens_used
-        
-        # Update last activity
-        user.last_activity = datetime.now(timezone.utc)
-        
-        self.db.commit()
+        daily_usage, monthly_usage = values[0], values[1]
         
         logger.info(f"Updated dummy task usage - User {user.id}, Task {task.id}, Tokens: {tokens_used}")
         
         return {
             "task_type": "dummy",
-            "user_daily_usage": user.current_daily_usage,
-            "user_monthly_usage": user.current_monthly_usage,
+            "user_daily_usage": daily_usage,
+            "user_monthly_usage": monthly_usage,
             "user_daily_quota": user.daily_quota,
             "user_monthly_quota": user.monthly_quota,
-            "daily_remaining": max(0, (user.daily_quota or 0) - (user.current_daily_usage or 0)),
-            "monthly_remaining": max(0, (user.monthly_quota or 0) - (user.current_monthly_usage or 0))
+            "daily_remaining": max(0, user.daily_quota - daily_usage),
+            "monthly_remaining": max(0, user.monthly_quota - monthly_usage)
         }
     
     def _update_regular_task_usage(
@@ -67,22 +201,18 @@ class QuotaTrackingService:
         user: User, 
         task: Task, 
         tokens_used: int, 
-        user_task: Optional[UserTask]
+        user_task: Optional[UserTask],
+        values: List[int]
     ) -> dict:
         """Update usage for regular tasks - both task and user quotas"""
         
-        # Update user's daily and monthly usage
-        user.current_daily_usage = (user.current_daily_usage or 0) + tokens_used
-        user.current_monthly_usage = (user.current_monthly_usage or 0) + tokens_used
-        user.last_activity = datetime.now(timezone.utc)
+        daily_usage, monthly_usage = values[0], values[1]
         
-        # Update task-specific usage if user_task exists
+        # Task-specific usage is tracked if user_task exists
         task_usage = 0
         if user_task:
-            user_task.tokens_used = (user_task.tokens_used or 0) + tokens_used
-            task_usage = user_task.tokens_used
-        
-        self.db.commit()
+            task_usage = values[2]
+            quota_coalescer.add_task_usage(user_task.id, tokens_used)
         
         logger.info(f"Updated regular task usage - User {user.id}, Task {task.id}, Tokens: {tokens_used}")
         
@@ -90,13 +220,13 @@ class QuotaTrackingService:
             "task_type": "regular",
             "task_usage": task_usage,
             "task_limit": task.token_limit,
-            "task_remaining": max(0, (task.token_limit or 0) - task_usage),
-            "user_daily_usage": user.current_daily_usage,
-            "user_monthly_usage": user.current_monthly_usage,
+            "task_remaining": max(0, task.token_limit - task_usage),
+            "user_daily_usage": daily_usage,
+            "user_monthly_usage": monthly_usage,
             "user_daily_quota": user.daily_quota,
             "user_monthly_quota": user.monthly_quota,
-            "daily_remaining": max(0, (user.daily_quota or 0) - (user.current_daily_usage or 0)),
-            "monthly_remaining": max(0, (user.monthly_quota or 0) - (user.current_monthly_usage or 0))
+            "daily_remaining": max(0, user.daily_quota - daily_usage),
+            "monthly_remaining": max(0, user.monthly_quota - monthly_usage)
         }
     
     def check_quotas_before_request(
@@ -109,6 +239,9 @@ class QuotaTrackingService:
         """
         Check if user/task has sufficient quota before making request
         
+        The estimate is reserved atomically in Redis when the check passes;
+        settle it with update_task_usage or give it back with release_reservation.
+        
         Returns: {
             "allowed": bool,
             "reason": str,
@@ -116,43 +249,36 @@ class QuotaTrackingService:
         }
         """
         try:
-            # Check user daily quota
-            user_daily_usage = user.current_daily_usage or 0
-            user_daily_quota = user.daily_quota or 0
-            if user_daily_quota > 0 and (user_daily_usage + estimated_tokens) > user_daily_quota:
-                return {
-                    "allowed": False,
-                    "reason": f"Daily quota exceeded. Used: {user_daily_usage}, Quota: {user_daily_quota}, Needed: {estimated_tokens}",
-                    "quota_type": "daily"
-                }
+            result = self._run_reserve(user, task, user_task, estimated_tokens)
             
-            # Check user monthly quota
-            user_monthly_usage = user.current_monthly_usage or 0
-            user_monthly_quota = user.monthly_quota or 0
-            if user_monthly_quota > 0 and (user_monthly_usage + estimated_tokens) > user_monthly_quota:
+            if result[0]:
+                quota_type = ("daily", "monthly", "task")[result[0] - 1]
+                used = result[1]
+                limit = (user.daily_quota, user.monthly_quota, task.token_limit)[result[0] - 1]
+                if quota_type == "task":
+                    reason = f"Task quota exceeded. Used: {used}, Limit: {limit}, Needed: {estimated_tokens}"
+                else:
+                    reason = f"{quota_type.capitalize()} quota exceeded. Used: {used}, Quota: {limit}, Needed: {estimated_tokens}"
                 return {
                     "allowed": False,
-                    "reason": f"Monthly quota exceeded. Used: {user_monthly_usage}, Quota: {user_monthly_quota}, Needed: {estimated_tokens}",
-                    "quota_type": "monthly"
+                    "reason": reason,
+                    "quota_type": quota_type
                 }
             
-            # For regular tasks, also check task-specific limits
-            if not task.is_dummy_task and user_task and task.token_limit:
-                task_usage = user_task.tokens_used or 0
-                if (task_usage + estimated_tokens) > task.token_limit:
-                    return {
-                        "allowed": False,
-                        "reason": f"Task quota exceeded. Used: {task_usage}, Limit: {task.token_limit}, Needed: {estimated_tokens}",
-                        "quota_type": "task"
-                    }
+            # Remaining quota as it stood before this reservation
+            daily_usage, monthly_usage = result[1] - estimated_tokens, result[2] - estimated_tokens
+            task_remaining = None
+            if user_task and not task.is_dummy_task:
+                task_usage = result[3] - estimated_tokens
+                task_remaining = max(0, task.token_limit - task_usage)
             
             return {
                 "allowed": True,
                 "reason": "Quota check passed",
                 "quota_info": {
-                    "user_daily_remaining": max(0, user_daily_quota - user_daily_usage),
-                    "user_monthly_remaining": max(0, user_monthly_quota - user_monthly_usage),
-                    "task_remaining": max(0, (task.token_limit or 0) - (user_task.tokens_used or 0)) if user_task and not task.is_dummy_task else None
+                    "user_daily_remaining": max(0, user.daily_quota - daily_usage),
+                    "user_monthly_remaining": max(0, user.monthly_quota - monthly_usage),
+                    "task_remaining": task_remaining
                 }
             }
             
@@ -167,10 +293,21 @@ class QuotaTrackingService:
     def get_quota_status(self, user: User, task: Task, user_task: Optional[UserTask] = None) -> dict:
         """Get current quota status for user and task"""
         
-        user_daily_usage = user.current_daily_usage or 0
-        user_monthly_usage = user.current_monthly_usage or 0
-        user_daily_quota = user.daily_quota or 0
-        user_monthly_quota = user.monthly_quota or 0
+        # Live counters from Redis, falling back to the logged and persisted totals
+        now = datetime.now(timezone.utc)
+        counters = self._counters(user, task, user_task, now)
+        live = self.redis.mget([c[0] for c in counters])
+        if None in live[:2]:
+            counters = self._load_seeds(user, now, counters)
+        values = [
+            int(value) if value is not None else seed
+            for value, (_, seed, _, _) in zip(live, counters)
+        ]
+        
+        user_daily_usage = values[0]
+        user_monthly_usage = values[1]
+        user_daily_quota = user.daily_quota
+        user_monthly_quota = user.monthly_quota
         
         status = {
             "user_quotas": {
@@ -192,7 +329,7 @@ class QuotaTrackingService:
         
         # Add task-specific quota info for regular tasks
         if not task.is_dummy_task and user_task and task.token_limit:
-            task_usage = user_task.tokens_used or 0
+            task_usage = values[2]
             status["task_quotas"] = {
                 "used": task_usage,
                 "limit": task.token_limit,
@@ -202,9 +339,35 @@ class QuotaTrackingService:
         
         return status
     
+    def reset_all_daily(self) -> int:
+        """
+        Reset daily usage for every user in one statement
+        
+        Run at 00:00 UTC by the Celery beat schedule in app.tasks.celery_app. Only
+        the Postgres totals need resetting: the Redis counters are keyed by day.
+        """
+        count = self.db.execute(update(User).values(current_daily_usage=0)).rowcount
+        self.db.commit()
+        logger.info(f"Reset daily usage for {count} users")
+        return count
+    
+    def reset_all_monthly(self) -> int:
+        """
+        Reset monthly usage for every user in one statement
+        
+        Run at 00:00 UTC on the 1st by the Celery beat schedule in app.tasks.celery_app.
+        Only the Postgres totals need resetting: the Redis counters are keyed by month.
+        """
+        count = self.db.execute(update(User).values(current_monthly_usage=0)).rowcount
+        self.db.commit()
+        logger.info(f"Reset monthly usage for {count} users")
+        return count
+    
     def reset_daily_usage(self, user: User) -> bool:
-        """Reset daily usage for a user (called by daily cron job)"""
+        """Reset daily usage for a single user (admin tools; the scheduled job uses reset_all_daily)"""
         try:
+            # Zero rather than delete: a missing counter would be re-seeded from the logs
+            self.redis.set(self._daily_key(user.id, datetime.now(timezone.utc)), 0, ex=DAILY_KEY_TTL)
             user.current_daily_usage = 0
             self.db.commit()
             logger.info(f"Reset daily usage for user {user.id}")
@@ -214,8 +377,10 @@ class QuotaTrackingService:
             return False
     
     def reset_monthly_usage(self, user: User) -> bool:
-        """Reset monthly usage for a user (called by monthly cron job)"""
+        """Reset monthly usage for a single user (admin tools; the scheduled job uses reset_all_monthly)"""
         try:
+            # Zero rather than delete: a missing counter would be re-seeded from the logs
+            self.redis.set(self._monthly_key(user.id, datetime.now(timezone.utc)), 0, ex=MONTHLY_KEY_TTL)
             user.current_monthly_usage = 0
             self.db.commit()
             logger.info(f"Reset monthly usage for user {user.id}")
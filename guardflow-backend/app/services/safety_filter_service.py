@@ -1,5 +1,6 @@
 import re
 import logging
+from collections import Counter
 from typing import Dict, List, Tuple
 
 logger = logging.getLogger(__name__)
@@ -38,6 +39,14 @@ class SafetyFilterService:
         ]
         
         self.compiled_suspicious = [re.compile(pattern, re.IGNORECASE) for pattern in self.suspicious_patterns]
+        
+        # Each pattern class is also combined into one alternation so checks scan the content once
+        self._harmful_regex = self._combine_patterns(self.harmful_patterns)
+        self._suspicious_regex = self._combine_patterns(self.suspicious_patterns)
+    
+    @staticmethod
+    def _combine_patterns(patterns: List[str]) -> "re.Pattern":
+        return re.compile("|".join(f"(?:{pattern})" for pattern in patterns), re.IGNORECASE)
     
     def check_content_safety(self, content: str) -> Dict:
         """
@@ -59,40 +68,31 @@ class SafetyFilterService:
                     "action": "allow"
                 }
             
-            content_lower = content.lower().strip()
             reasons = []
             risk_level = "low"
             
             # Check for harmful content patterns
-            harmful_matches = []
-            for pattern in self.compiled_patterns:
-                matches = pattern.findall(content)
-                if matches:
-                    harmful_matches.extend(matches)
+            harmful_matches = [match.group(0) for match in self._harmful_regex.finditer(content)]
             
             if harmful_matches:
+                # The request is blocked either way; skip the checks that can only add medium risk
                 reasons.append(f"Harmful content detected: {', '.join(set(harmful_matches))}")
                 risk_level = "high"
-            
-            # Check for suspicious patterns (jailbreak attempts)
-            suspicious_matches = []
-            for pattern in self.compiled_suspicious:
-                if pattern.search(content):
-                    suspicious_matches.append("jailbreak_attempt")
-            
-            if suspicious_matches:
-                reasons.append("Suspicious request pattern detected")
-                risk_level = "medium" if risk_level == "low" else "high"
-            
-            # Check for excessively long requests (potential spam)
-            if len(content) > 10000:  # 10K characters
-                reasons.append("Excessively long request")
-                risk_level = "medium" if risk_level == "low" else risk_level
-            
-            # Check for repetitive content (spam detection)
-            if self._is_repetitive_content(content):
-                reasons.append("Repetitive content detected")
-                risk_level = "medium" if risk_level == "low" else risk_level
+            else:
+                # Check for suspicious patterns (jailbreak attempts)
+                if self._suspicious_regex.search(content):
+                    reasons.append("Suspicious request pattern detected")
+                    risk_level = "medium"
+                
+                # Check for excessively long requests (potential spam)
+                if len(content) > 10000:  # 10K characters
+                    reasons.append("Excessively long request")
+                    risk_level = "medium"
+                
+                # Check for repetitive content (spam detection)
+                if self._is_repetitive_content(content):
+                    reasons.append("Repetitive content detected")
+                    risk_level = "medium"
             
             # Determine action based on risk level
             if risk_level == "high":
@@ -165,13 +165,10 @@ class SafetyFilterService:
             if len(words) < 10:
                 return False
             
-            # Check for word repetition
-            word_counts = {}
-            for word in words:
-                word_counts[word] = word_counts.get(word, 0) + 1
+            # Count words in C rather than with a per-word Python loop
+            max_count = Counter(words).most_common(1)[0][1]
             
             # If any word appears more than 30% of the time, it's repetitive
-            max_count = max(word_counts.values())
             repetition_ratio = max_count / len(words)
             
             return repetition_ratio > 0.3
@@ -196,9 +193,11 @@ class SafetyFilterService:
             if pattern_type == "harmful":
                 self.harmful_patterns.append(pattern)
                 self.compiled_patterns.append(compiled_pattern)
+                self._harmful_regex = self._combine_patterns(self.harmful_patterns)
             elif pattern_type == "suspicious":
                 self.suspicious_patterns.append(pattern)
                 self.compiled_suspicious.append(compiled_pattern)
+                self._suspicious_regex = self._combine_patterns(self.suspicious_patterns)
             else:
                 return False
             
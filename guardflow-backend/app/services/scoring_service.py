@@ -1,7 +1,13 @@
 from typing import Dict, Any
+from collections import deque
+from sqlalchemy import extract, func, update
 from sqlalchemy.orm import Session
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import logging
+import threading
+import time
+
+from cachetools import TTLCache
 
 from app.core.config import settings
 from app.models.user import User
@@ -10,6 +16,49 @@ from app.models.log import Log
 
 logger = logging.getLogger(__name__)
 
+# Score thresholds, read from settings once at import
+DEVIATION_THRESHOLD = float(settings.DEVIATION_THRESHOLD)
+WARNING_THRESHOLD = float(settings.WARNING_THRESHOLD)
+# Users below this score skip the pattern checks on requests that earned no penalty
+CLEAN_SCORE_WATERMARK = WARNING_THRESHOLD * 0.5
+
+# Rapid-request detection: more than RAPID_REQUEST_LIMIT requests in RAPID_REQUEST_WINDOW seconds
+RAPID_REQUEST_LIMIT = 20
+RAPID_REQUEST_WINDOW = 600
+
+# Per-user timestamps of recent scored requests; only the newest LIMIT + 1 are needed
+_recent_requests: TTLCache = TTLCache(maxsize=100000, ttl=RAPID_REQUEST_WINDOW)
+_recent_requests_lock = threading.Lock()
+
+
+def _record_request(user_id: int) -> int:
+    """Record a request for a user and return how many fall in the sliding window"""
+    now = time.monotonic()
+    with _recent_requests_lock:
+        window = _recent_requests.get(user_id)
+        if window is None:
+            window = deque(maxlen=RAPID_REQUEST_LIMIT + 1)
+        window.append(now)
+        # Re-insert so the entry's TTL restarts while the user stays active
+        _recent_requests[user_id] = window
+        
+        cutoff = now - RAPID_REQUEST_WINDOW
+        while window[0] < cutoff:
+            window.popleft()
+        return len(window)
+
+
+# Behavior analysis results by (user_id, days); numbers move slowly, so a minute of staleness is fine
+_behavior_cache: TTLCache = TTLCache(maxsize=1024, ttl=60)
+_behavior_cache_lock = threading.Lock()
+
+
+def invalidate_behavior_analysis(user_id: int) -> None:
+    """Drop cached behavior analyses for a user (after admin changes to their score)"""
+    with _behavior_cache_lock:
+        for key in [key for key in _behavior_cache if key[0] == user_id]:
+            _behavior_cache.pop(key, None)
+
 
 class ScoringService:
     def __init__(self, db: Session):
@@ -27,7 +76,7 @@ class ScoringService:
         score_delta = 0.0
         
         # Check if intent is allowed for this task
-        if task.allowed_intents and intent_classification not in task.allowed_intents:
+        if task.allowed_intents_set and intent_classification not in task.allowed_intents_set:
             if intent_classification == "off_topic":
                 score_delta += 1.0  # Major penalty for off-topic
             else:
@@ -37,45 +86,52 @@ class ScoringService:
         if confidence < 0.3:
             score_delta += 0.1  # Uncertain classification
         
-        # Pattern analysis - check for sudden topic switches
-        recent_logs = self.db.query(Log).filter(
+        # Frequency analysis - check for rapid requests (in-process sliding window, no query)
+        rapid_penalty = 0.0
+        if _record_request(user.id) > RAPID_REQUEST_LIMIT:  # More than 20 requests in 10 minutes
+            rapid_penalty = 0.2
+        
+        # Clean request from a user well below the warning threshold: the topic
+        # switch check only matters for borderline users, so skip the query
+        if score_delta == 0.0 and user.deviation_score < CLEAN_SCORE_WATERMARK:
+            return rapid_penalty
+        
+        recent_logs = self.db.query(Log.intent_classification).filter(
             Log.user_id == user.id,
-            Log.timestamp >= datetime.utcnow() - timedelta(hours=1)
-        ).order_by(Log.timestamp.desc()).limit(5).all()
-        
-        if len(recent_logs) >= 3:
-            # Check for topic switching
-            recent_intents = [log.intent_classification for log in recent_logs]
-            unique_intents = set(recent_intents)
-            
+            Log.timestamp >= datetime.now(timezone.utc) - timedelta(hours=1)
+        ).order_by(Log.timestamp.desc()).limit(5)
+        
+        # Pattern analysis - check for sudden topic switches among the last 5 requests,
+        # stopping as soon as 3 different topics have been seen
+        unique_intents = set()
+        for log in recent_logs:
+            unique_intents.add(log.intent_classification)
             if len(unique_intents) >= 3:  # 3+ different topics in last hour
                 score_delta += 0.5
+                break
         
-        # Frequency analysis - check for rapid requests
-        requests_last_10_min = self.db.query(Log).filter(
-            Log.user_id == user.id,
-            Log.timestamp >= datetime.utcnow() - timedelta(minutes=10)
-        ).count()
-        
-        if requests_last_10_min > 20:  # More than 20 requests in 10 minutes
-            score_delta += 0.2
-        
-        return score_delta
+        return score_delta + rapid_penalty
 
     async def check_and_block_user(self, user: User) -> None:
-        """Check if user should be blocked based on deviation score"""
+        """Check if user should be blocked based on deviation score (the caller commits)"""
         
-        if user.deviation_score >= settings.DEVIATION_THRESHOLD:
+        if user.deviation_score >= DEVIATION_THRESHOLD:
             if not user.is_blocked:
-                user.is_blocked = True
-                user.blocked_reason = f"Automatic block: deviation score {user.deviation_score} exceeded threshold {settings.DEVIATION_THRESHOLD}"
-                user.blocked_at = datetime.utcnow()
+                # Guarded on is_blocked so concurrent requests block the user only once
+                blocked = self.db.execute(
+                    update(User)
+                    .where(User.id == user.id, User.is_blocked == False)
+                    .values(
+                        is_blocked=True,
+                        blocked_reason=f"Automatic block: deviation score {user.deviation_score} exceeded threshold {DEVIATION_THRESHOLD}",
+                        blocked_at=func.now()
+                    )
+                ).rowcount
                 
-                logger.warning(f"User {user.id} ({user.email}) automatically blocked due to high deviation score")
-                
-                self.db.commit()
+                if blocked:
+                    logger.warning(f"User {user.id} ({user.email}) automatically blocked due to high deviation score")
         
-        elif user.deviation_score >= settings.WARNING_THRESHOLD:
+        elif user.deviation_score >= WARNING_THRESHOLD:
             # Log warning but don't block
             logger.info(f"User {user.id} ({user.email}) approaching deviation threshold: {user.deviation_score}")
 
@@ -90,6 +146,7 @@ class ScoringService:
         user.deviation_score = 0.0
         
         self.db.commit()
+        invalidate_behavior_analysis(user_id)
         
         logger.info(f"Reset deviation score for user {user_id} from {old_score} to 0.0")
         
@@ -101,20 +158,55 @@ class ScoringService:
         }
 
     async def get_user_behavior_analysis(self, user_id: int, days: int = 7) -> Dict[str, Any]:
-        """Get detailed behavior analysis for a user"""
+        """Get detailed behavior analysis for a user (cached for up to a minute)"""
+        
+        with _behavior_cache_lock:
+            cached = _behavior_cache.get((user_id, days))
+        if cached is not None:
+            return dict(cached)
         
         user = self.db.query(User).filter(User.id == user_id).first()
         if not user:
             raise ValueError(f"User {user_id} not found")
         
-        # Get logs from last N days
+        # Aggregate logs from last N days in the database: one row per intent,
+        # per hour of day and per date (GROUPING SETS), in a single round trip
         since_date = datetime.utcnow() - timedelta(days=days)
-        logs = self.db.query(Log).filter(
+        hour = extract("hour", Log.timestamp)
+        day = func.date(Log.timestamp)
+        rows = self.db.query(
+            Log.intent_classification,
+            hour,
+            day,
+            func.grouping(Log.intent_classification),
+            func.grouping(hour),
+            func.count(),
+            func.sum(Log.openai_tokens_used)
+        ).filter(
             Log.user_id == user_id,
             Log.timestamp >= since_date
+        ).group_by(
+            func.grouping_sets(Log.intent_classification, hour, day)
         ).all()
         
-        if not logs:
+        # Analyze patterns
+        intent_distribution = {}
+        hourly_distribution = {}
+        daily_tokens = {}
+        
+        for intent, log_hour, log_date, not_by_intent, not_by_hour, count, tokens in rows:
+            if not not_by_intent:
+                # Intent distribution
+                intent = intent or "unknown"
+                intent_distribution[intent] = intent_distribution.get(intent, 0) + count
+            elif not not_by_hour:
+                # Hourly distribution
+                hourly_distribution[int(log_hour)] = count
+            else:
+                # Daily token usage
+                daily_tokens[log_date.isoformat()] = int(tokens or 0)
+        
+        if not intent_distribution:
             return {
                 "user_id": user_id,
                 "analysis_period_days": days,
@@ -122,27 +214,8 @@ class ScoringService:
                 "message": "No activity in the analysis period"
             }
         
-        # Analyze patterns
-        intent_distribution = {}
-        hourly_distribution = {}
-        daily_tokens = {}
-        
-        for log in logs:
-            # Intent distribution
-            intent = log.intent_classification or "unknown"
-            intent_distribution[intent] = intent_distribution.get(intent, 0) + 1
-            
-            # Hourly distribution
-            hour = log.timestamp.hour
-            hourly_distribution[hour] = hourly_distribution.get(hour, 0) + 1
-            
-            # Daily token usage
-            date_str = log.timestamp.date().isoformat()
-            tokens = log.openai_tokens_used or 0
-            daily_tokens[date_str] = daily_tokens.get(date_str, 0) + tokens
-        
         # Calculate metrics
-        total_requests = len(logs)
+        total_requests = sum(intent_distribution.values())
         avg_requests_per_day = total_requests / days
         total_tokens = sum(daily_tokens.values())
         avg_tokens_per_request = total_tokens / total_requests if total_requests > 0 else 0
@@ -150,18 +223,18 @@ class ScoringService:
         # Risk indicators
         risk_indicators = []
         
-        if user.deviation_score > settings.WARNING_THRESHOLD:
+        if user.deviation_score > WARNING_THRESHOLD:
             risk_indicators.append(f"High deviation score: {user.deviation_score}")
         
         off_topic_ratio = intent_distribution.get("off_topic", 0) / total_requests
         if off_topic_ratio > 0.3:
             risk_indicators.append(f"High off-topic ratio: {off_topic_ratio:.2%}")
         
-        max_daily_requests = max([hourly_distribution.get(h, 0) for h in range(24)])
-        if max_daily_requests > 50:
-            risk_indicators.append(f"High hourly request volume: {max_daily_requests}")
+        peak_hour_requests = max(hourly_distribution.values(), default=0)
+        if peak_hour_requests > 50:
+            risk_indicators.append(f"High hourly request volume: {peak_hour_requests}")
         
-        return {
+        analysis = {
             "user_id": user_id,
             "analysis_period_days": days,
             "current_deviation_score": float(user.deviation_score),
@@ -174,4 +247,8 @@ class ScoringService:
             "daily_token_usage": daily_tokens,
             "risk_indicators": risk_indicators,
             "risk_level": "high" if len(risk_indicators) >= 2 else "medium" if len(risk_indicators) == 1 else "low"
-        }
\ No newline at end of file
+        }
+        
+        with _behavior_cache_lock:
+            _behavior_cache[(user_id, days)] = analysis
+        return dict(analysis)
\ No newline at end of file
@@ -0,0 +1,53 @@
+"""
+Celery application and periodic jobs.
+Run the worker with the embedded beat scheduler so the schedule below fires:
+
+    celery -A app.tasks.celery_app worker --beat --loglevel=info
+"""
+
+from celery import Celery
+from celery.schedules import crontab
+
+from app.core.config import settings
+from app.database import SessionLocal
+from app.api.deps import redis_client
+from app.services.quota_tracking_service import QuotaTrackingService
+
+celery_app = Celery(
+    "guardflow",
+    broker=settings.CELERY_BROKER_URL,
+    backend=settings.CELERY_RESULT_BACKEND
+)
+
+# Quota periods are UTC days and months, matching the Redis counter keys
+celery_app.conf.timezone = "UTC"
+celery_app.conf.beat_schedule = {
+    "reset-daily-usage": {
+        "task": "app.tasks.celery_app.reset_daily_usage",
+        "schedule": crontab(minute=0, hour=0)
+    },
+    "reset-monthly-usage": {
+        "task": "app.tasks.celery_app.reset_monthly_usage",
+        "schedule": crontab(minute=0, hour=0, day_of_month=1)
+    }
+}
+
+
+@celery_app.task
+def reset_daily_usage() -> int:
+    """Zero every user's current_daily_usage at the start of the day"""
+    db = SessionLocal()
+    try:
+        return QuotaTrackingService(db, redis_client).reset_all_daily()
+    finally:
+        db.close()
+
+
+@celery_app.task
+def reset_monthly_usage() -> int:
+    """Zero every user's current_monthly_usage at the start of the month"""
+    db = SessionLocal()
+    try:
+        return QuotaTrackingService(db, redis_client).reset_all_monthly()
+    finally:
+        db.close()
\ No newline at end of file
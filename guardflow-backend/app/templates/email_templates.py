@@ -3,68 +3,88 @@ Email templates for user invitations and notifications.
 These templates are ready for integration with any email service.
 """
 
-from typing import Dict, Any
+from html import escape
+from string import Template
+from typing import Dict, Any, List
 
 
-def get_invitation_email_template(data: Dict[str, Any]) -> Dict[str, str]:
-    """
-    Generate invitation email template
-    
-    Args:
-        data: Dictionary containing:
-            - company_name: Name of the company
-            - inviter_name: Name of person who sent invitation
-            - recipient_email: Email of person being invited
-            - role_name: Role they're being invited as
-            - invitation_link: Full URL to accept invitation
-            - expires_in_days: Number of days until expiration (usually 7)
-    
-    Returns:
-        Dict with 'subject', 'html_body', and 'text_body'
-    """
-    
-    subject = f"You're invited to join {data['company_name']} on Guardflow"
-    
-    html_body = f"""
+class EmailTemplate:
+    """Email template parsed once at import and rendered per send"""
+    
+    def __init__(self, subject: str, html_body: str, text_body: str):
+        self.subject = Template(subject)
+        self.html_body = Template(html_body)
+        self.text_body = Template(text_body)
+    
+    def render(self, data: Dict[str, Any]) -> Dict[str, str]:
+        """Substitute the dynamic fields into the compiled template (HTML-escaped in the HTML body)"""
+        return {
+            "subject": self.subject.substitute(data),
+            "html_body": self.html_body.substitute({key: escape(str(value)) for key, value in data.items()}),
+            "text_body": self.text_body.substitute(data)
+        }
+    
+    def render_batch(self, common: Dict[str, Any], recipients: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+        """Render the shared fields once, then fill each recipient's fields in with str.replace"""
+        fields = list(recipients[0]) if recipients else []
+        placeholders = {field: f"__{field.upper()}__" for field in fields}
+        partial = self.render({**common, **placeholders})
+        
+        rendered = []
+        for recipient in recipients:
+            subject, html_body, text_body = partial["subject"], partial["html_body"], partial["text_body"]
+            for field, placeholder in placeholders.items():
+                value = str(recipient[field])
+                subject = subject.replace(placeholder, value)
+                html_body = html_body.replace(placeholder, escape(value))
+                text_body = text_body.replace(placeholder, value)
+            rendered.append({"subject": subject, "html_body": html_body, "text_body": text_body})
+        
+        return rendered
+
+
+INVITATION_TEMPLATE = EmailTemplate(
+    subject="You're invited to join ${company_name} on Guardflow",
+    html_body="""
     <!DOCTYPE html>
     <html>
     <head>
         <meta charset="utf-8">
         <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        <title>Invitation to join {data['company_name']}</title>
+        <title>Invitation to join ${company_name}</title>
         <style>
-            body {{
+            body {
                 font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, 'Helvetica Neue', Arial, sans-serif;
                 line-height: 1.6;
                 color: #333;
                 max-width: 600px;
                 margin: 0 auto;
                 padding: 20px;
-            }}
-            .header {{
+            }
+            .header {
                 background-color: #f8f9fa;
                 padding: 30px;
                 text-align: center;
                 border-radius: 8px;
                 margin-bottom: 30px;
-            }}
-            .logo {{
+            }
+            .logo {
                 font-size: 24px;
                 font-weight: bold;
                 color: #007bff;
                 margin-bottom: 10px;
-            }}
-            .content {{
+            }
+            .content {
                 padding: 0 20px;
-            }}
-            .invitation-box {{
+            }
+            .invitation-box {
                 background-color: #f8f9fa;
                 border-left: 4px solid #007bff;
                 padding: 20px;
                 margin: 20px 0;
                 border-radius: 4px;
-            }}
-            .cta-button {{
+            }
+            .cta-button {
                 display: inline-block;
                 background-color: #007bff;
                 color: white !important;
@@ -74,26 +94,26 @@ def get_invitation_email_template(data: Dict[str, Any]) -> Dict[str, str]:
                 font-weight: 500;
                 margin: 20px 0;
                 text-align: center;
-            }}
-            .cta-button:hover {{
+            }
+            .cta-button:hover {
                 background-color: #0056b3;
-            }}
-            .details {{
+            }
+            .details {
                 background-color: #fff;
                 border: 1px solid #dee2e6;
                 padding: 15px;
                 border-radius: 4px;
                 margin: 20px 0;
-            }}
-            .footer {{
+            }
+            .footer {
                 text-align: center;
                 color: #666;
                 font-size: 14px;
                 margin-top: 40px;
                 padding-top: 20px;
                 border-top: 1px solid #dee2e6;
-            }}
-            .warning {{
+            }
+            .warning {
                 background-color: #fff3cd;
                 border: 1px solid #ffeaa7;
                 color: #856404;
@@ -101,19 +121,19 @@ def get_invitation_email_template(data: Dict[str, Any]) -> Dict[str, str]:
                 border-radius: 4px;
                 margin: 15px 0;
                 font-size: 14px;
-            }}
+            }
         </style>
     </head>
     <body>
         <div class="header">
             <div class="logo">🛡️ Guardflow</div>
-            <h1>You're invited to join {data['company_name']}</h1>
+            <h1>You're invited to join ${company_name}</h1>
         </div>
         
         <div class="content">
             <p>Hello!</p>
             
-            <p><strong>{data['inviter_name']}</strong> has invited you to join <strong>{data['company_name']}</strong>'s Guardflow workspace as a <strong>{data['role_name']}</strong>.</p>
+            <p><strong>${inviter_name}</strong> has invited you to join <strong>${company_name}</strong>'s Guardflow workspace as a <strong>${role_name}</strong>.</p>
             
             <div class="invitation-box">
                 <h3>🎉 Welcome to the team!</h3>
@@ -121,128 +141,145 @@ def get_invitation_email_template(data: Dict[str, Any]) -> Dict[str, str]:
             </div>
             
             <div style="text-align: center;">
-                <a href="{data['invitation_link']}" class="cta-button">Accept Invitation</a>
+                <a href="${invitation_link}" class="cta-button">Accept Invitation</a>
             </div>
             
             <div class="details">
                 <h4>Invitation Details:</h4>
                 <ul>
-                    <li><strong>Company:</strong> {data['company_name']}</li>
-                    <li><strong>Role:</strong> {data['role_name']}</li>
-                    <li><strong>Invited by:</strong> {data['inviter_name']}</li>
-                    <li><strong>Your email:</strong> {data['recipient_email']}</li>
+                    <li><strong>Company:</strong> ${company_name}</li>
+                    <li><strong>Role:</strong> ${role_name}</li>
+                    <li><strong>Invited by:</strong> ${inviter_name}</li>
+                    <li><strong>Your email:</strong> ${recipient_email}</li>
                 </ul>
             </div>
             
             <div class="warning">
-                ⏰ <strong>Important:</strong> This invitation expires in {data['expires_in_days']} days. 
+                ⏰ <strong>Important:</strong> This invitation expires in ${expires_in_days} days. 
                 Please accept it soon to avoid having to request a new one.
             </div>
             
-            <p>If you have any questions, feel free to reach out to {data['inviter_name']} or your team administrator.</p>
+            <p>If you have any questions, feel free to reach out to ${inviter_name} or your team administrator.</p>
             
             <p>Best regards,<br>The Guardflow Team</p>
         </div>
         
         <div class="footer">
             <p>If you didn't expect this invitation, you can safely ignore this email.</p>
-            <p>This email was sent to {data['recipient_email']} by {data['company_name']}.</p>
+            <p>This email was sent to ${recipient_email} by ${company_name}.</p>
         </div>
     </body>
     </html>
-    """
-    
-    text_body = f"""
-    You're invited to join {data['company_name']} on Guardflow
+    """,
+    text_body="""
+    You're invited to join ${company_name} on Guardflow
     
     Hello!
     
-    {data['inviter_name']} has invited you to join {data['company_name']}'s Guardflow workspace as a {data['role_name']}.
+    ${inviter_name} has invited you to join ${company_name}'s Guardflow workspace as a ${role_name}.
     
     Guardflow helps your team access AI models securely with built-in monitoring and usage controls.
     
     Invitation Details:
-    - Company: {data['company_name']}
-    - Role: {data['role_name']}
-    - Invited by: {data['inviter_name']}
-    - Your email: {data['recipient_email']}
+    - Company: ${company_name}
+    - Role: ${role_name}
+    - Invited by: ${inviter_name}
+    - Your email: ${recipient_email}
     
     To accept this invitation, click the link below:
-    {data['invitation_link']}
+    ${invitation_link}
     
-    ⏰ Important: This invitation expires in {data['expires_in_days']} days.
+    ⏰ Important: This invitation expires in ${expires_in_days} days.
     
-    If you have any questions, feel free to reach out to {data['inviter_name']} or your team administrator.
+    If you have any questions, feel free to reach out to ${inviter_name} or your team administrator.
     
     Best regards,
     The Guardflow Team
     
     ---
     If you didn't expect this invitation, you can safely ignore this email.
-    This email was sent to {data['recipient_email']} by {data['company_name']}.
+    This email was sent to ${recipient_email} by ${company_name}.
     """
-    
-    return {
-        "subject": subject,
-        "html_body": html_body,
-        "text_body": text_body
-    }
+)
 
 
-def get_welcome_email_template(data: Dict[str, Any]) -> Dict[str, str]:
+def get_invitation_email_template(data: Dict[str, Any]) -> Dict[str, str]:
     """
-    Generate welcome email template for when user accepts invitation
+    Generate invitation email template
     
     Args:
         data: Dictionary containing:
-            - user_name: Name of the new user
             - company_name: Name of the company
-            - role_name: Their role
-            - login_url: URL to login to the platform
+            - inviter_name: Name of person who sent invitation
+            - recipient_email: Email of person being invited
+            - role_name: Role they're being invited as
+            - invitation_link: Full URL to accept invitation
+            - expires_in_days: Number of days until expiration (usually 7)
+    
+    Returns:
+        Dict with 'subject', 'html_body', and 'text_body'
+    """
+    
+    return INVITATION_TEMPLATE.render(data)
+
+
+def render_invitations(common: Dict[str, Any], recipients: List[Dict[str, Any]]) -> List[Dict[str, str]]:
     """
+    Render invitation emails for many recipients sharing one company/inviter/role
+    
+    Args:
+        common: company_name, inviter_name, role_name and expires_in_days
+        recipients: List of dicts with recipient_email and invitation_link
     
-    subject = f"Welcome to {data['company_name']} on Guardflow!"
+    Returns:
+        List of dicts with 'subject', 'html_body', and 'text_body', one per recipient
+    """
     
-    html_body = f"""
+    return INVITATION_TEMPLATE.render_batch(common, recipients)
+
+
+WELCOME_TEMPLATE = EmailTemplate(
+    subject="Welcome to ${company_name} on Guardflow!",
+    html_body="""
     <!DOCTYPE html>
     <html>
     <head>
         <meta charset="utf-8">
         <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        <title>Welcome to {data['company_name']}</title>
+        <title>Welcome to ${company_name}</title>
         <style>
-            body {{
+            body {
                 font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, 'Helvetica Neue', Arial, sans-serif;
                 line-height: 1.6;
                 color: #333;
                 max-width: 600px;
                 margin: 0 auto;
                 padding: 20px;
-            }}
-            .header {{
+            }
+            .header {
                 background-color: #28a745;
                 color: white;
                 padding: 30px;
                 text-align: center;
                 border-radius: 8px;
                 margin-bottom: 30px;
-            }}
-            .logo {{
+            }
+            .logo {
                 font-size: 24px;
                 font-weight: bold;
                 margin-bottom: 10px;
-            }}
-            .content {{
+            }
+            .content {
                 padding: 0 20px;
-            }}
-            .success-box {{
+            }
+            .success-box {
                 background-color: #d4edda;
                 border-left: 4px solid #28a745;
                 padding: 20px;
                 margin: 20px 0;
                 border-radius: 4px;
-            }}
-            .cta-button {{
+            }
+            .cta-button {
                 display: inline-block;
                 background-color: #007bff;
                 color: white !important;
@@ -251,39 +288,39 @@ def get_welcome_email_template(data: Dict[str, Any]) -> Dict[str, str]:
                 border-radius: 5px;
                 font-weight: 500;
                 margin: 20px 0;
-            }}
-            .features {{
+            }
+            .features {
                 background-color: #f8f9fa;
                 padding: 20px;
                 border-radius: 4px;
                 margin: 20px 0;
-            }}
-            .footer {{
+            }
+            .footer {
                 text-align: center;
                 color: #666;
                 font-size: 14px;
                 margin-top: 40px;
                 padding-top: 20px;
                 border-top: 1px solid #dee2e6;
-            }}
+            }
         </style>
     </head>
     <body>
         <div class="header">
             <div class="logo">🛡️ Guardflow</div>
-            <h1>Welcome to {data['company_name']}!</h1>
+            <h1>Welcome to ${company_name}!</h1>
         </div>
         
         <div class="content">
-            <p>Hi {data['user_name']},</p>
+            <p>Hi ${user_name},</p>
             
             <div class="success-box">
                 <h3>🎉 Account Successfully Created!</h3>
-                <p>Your Guardflow account has been set up and you're now part of the {data['company_name']} team as a <strong>{data['role_name']}</strong>.</p>
+                <p>Your Guardflow account has been set up and you're now part of the ${company_name} team as a <strong>${role_name}</strong>.</p>
             </div>
             
             <div style="text-align: center;">
-                <a href="{data['login_url']}" class="cta-button">Go to Dashboard</a>
+                <a href="${login_url}" class="cta-button">Go to Dashboard</a>
             </div>
             
             <div class="features">
@@ -309,14 +346,13 @@ def get_welcome_email_template(data: Dict[str, Any]) -> Dict[str, str]:
         </div>
     </body>
     </html>
-    """
+    """,
+    text_body="""
+    Welcome to ${company_name} on Guardflow!
     
-    text_body = f"""
-    Welcome to {data['company_name']} on Guardflow!
+    Hi ${user_name},
     
-    Hi {data['user_name']},
-    
-    Your Guardflow account has been set up and you're now part of the {data['company_name']} team as a {data['role_name']}.
+    Your Guardflow account has been set up and you're now part of the ${company_name} team as a ${role_name}.
     
     What you can do now:
     - Access AI models securely through your company's configured providers
@@ -326,7 +362,7 @@ def get_welcome_email_template(data: Dict[str, Any]) -> Dict[str, str]:
     - Benefit from built-in security monitoring and controls
     
     To get started, visit your dashboard:
-    {data['login_url']}
+    ${login_url}
     
     If you need help getting started or have any questions, don't hesitate to reach out to your team administrator.
     
@@ -338,42 +374,47 @@ def get_welcome_email_template(data: Dict[str, Any]) -> Dict[str, str]:
     ---
     Need support? Contact your team administrator or visit our help center.
     """
-    
-    return {
-        "subject": subject,
-        "html_body": html_body,
-        "text_body": text_body
-    }
+)
 
 
-def get_invitation_reminder_template(data: Dict[str, Any]) -> Dict[str, str]:
-    """
-    Generate reminder email template for pending invitations
+def get_welcome_email_template(data: Dict[str, Any]) -> Dict[str, str]:
     """
+    Generate welcome email template for when user accepts invitation
     
-    subject = f"Reminder: Your invitation to join {data['company_name']} expires soon"
+    Args:
+        data: Dictionary containing:
+            - user_name: Name of the new user
+            - company_name: Name of the company
+            - role_name: Their role
+            - login_url: URL to login to the platform
+    """
     
-    html_body = f"""
+    return WELCOME_TEMPLATE.render(data)
+
+
+INVITATION_REMINDER_TEMPLATE = EmailTemplate(
+    subject="Reminder: Your invitation to join ${company_name} expires soon",
+    html_body="""
     <!DOCTYPE html>
     <html>
     <head>
         <meta charset="utf-8">
         <title>Invitation Reminder</title>
         <style>
-            body {{
+            body {
                 font-family: Arial, sans-serif;
                 max-width: 600px;
                 margin: 0 auto;
                 padding: 20px;
-            }}
-            .reminder-box {{
+            }
+            .reminder-box {
                 background-color: #fff3cd;
                 border: 1px solid #ffeaa7;
                 padding: 20px;
                 border-radius: 4px;
                 margin: 20px 0;
-            }}
-            .cta-button {{
+            }
+            .cta-button {
                 display: inline-block;
                 background-color: #ffc107;
                 color: black !important;
@@ -382,7 +423,7 @@ def get_invitation_reminder_template(data: Dict[str, Any]) -> Dict[str, str]:
                 border-radius: 5px;
                 font-weight: 500;
                 margin: 20px 0;
-            }}
+            }
         </style>
     </head>
     <body>
@@ -391,40 +432,42 @@ def get_invitation_reminder_template(data: Dict[str, Any]) -> Dict[str, str]:
         <div class="reminder-box">
             <p>Hi there!</p>
             
-            <p>This is a friendly reminder that your invitation to join <strong>{data['company_name']}</strong> on Guardflow expires in <strong>{data['days_left']} days</strong>.</p>
+            <p>This is a friendly reminder that your invitation to join <strong>${company_name}</strong> on Guardflow expires in <strong>${days_left} days</strong>.</p>
             
             <p>Don't miss out on joining the team!</p>
         </div>
         
         <div style="text-align: center;">
-            <a href="{data['invitation_link']}" class="cta-button">Accept Invitation Now</a>
+            <a href="${invitation_link}" class="cta-button">Accept Invitation Now</a>
         </div>
         
-        <p>If you have any questions about this invitation, please reach out to {data['inviter_name']}.</p>
+        <p>If you have any questions about this invitation, please reach out to ${inviter_name}.</p>
         
         <p>Best regards,<br>The Guardflow Team</p>
     </body>
     </html>
-    """
-    
-    text_body = f"""
-    Reminder: Your invitation to join {data['company_name']} expires soon
+    """,
+    text_body="""
+    Reminder: Your invitation to join ${company_name} expires soon
     
     Hi there!
     
-    This is a friendly reminder that your invitation to join {data['company_name']} on Guardflow expires in {data['days_left']} days.
+    This is a friendly reminder that your invitation to join ${company_name} on Guardflow expires in ${days_left} days.
     
     To accept your invitation:
-    {data['invitation_link']}
+    ${invitation_link}
     
-    If you have any questions, please reach out to {data['inviter_name']}.
+    If you have any questions, please reach out to ${inviter_name}.
     
     Best regards,
     The Guardflow Team
     """
+)
+
+
+def get_invitation_reminder_template(data: Dict[str, Any]) -> Dict[str, str]:
+    """
+    Generate reminder email template for pending invitations
+    """
     
-    return {
-        "subject": subject,
-        "html_body": html_body,
-        "text_body": text_body
-    }
\ No newline at end of file
+    return INVITATION_REMINDER_TEMPLATE.render(data)
\ No newline at end of file
@@ -6,6 +6,7 @@ import sys
 import os
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.orm import sessionmaker
 from app.database import engine
 from app.models.user import User
@@ -13,25 +14,17 @@ from app.core.security import generate_api_token, hash_api_token
 from app.core.config import settings
 
 # Create session
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine, expire_on_commit=False)
 
 def create_admin_user():
     db = SessionLocal()
     try:
-        # Check if admin user already exists
-        existing_admin = db.query(User).filter(User.email == settings.ADMIN_EMAIL).first()
-        if existing_admin:
-            print(f"Admin user {settings.ADMIN_EMAIL} already exists!")
-            print(f"User ID: {existing_admin.id}")
-            print(f"API Token: {existing_admin.token_hash}")
-            return
-        
         # Generate API token for admin
         api_token = generate_api_token()
         token_hash = hash_api_token(api_token)
         
-        # Create admin user
-        admin_user = User(
+        # Create admin user in one round trip; an existing email is left untouched
+        stmt = pg_insert(User).values(
             email=settings.ADMIN_EMAIL,
             name="Admin User",
             token_hash=token_hash,
@@ -40,15 +33,20 @@ def create_admin_user():
             requests_per_hour=500,  # Higher rate limit for admin
             is_active=True,
             is_blocked=False
-        )
-        
-        db.add(admin_user)
+        ).on_conflict_do_nothing(index_elements=['email']).returning(User.id)
+        row = db.execute(stmt).first()
         db.commit()
-        db.refresh(admin_user)
+        
+        if row is None:
+            existing_admin = db.query(User).filter(User.email == settings.ADMIN_EMAIL).first()
+            print(f"Admin user {settings.ADMIN_EMAIL} already exists!")
+            print(f"User ID: {existing_admin.id}")
+            print(f"API Token: {existing_admin.token_hash}")
+            return
         
         print("✅ Admin user created successfully!")
-        print(f"Email: {admin_user.email}")
-        print(f"User ID: {admin_user.id}")
+        print(f"Email: {settings.ADMIN_EMAIL}")
+        print(f"User ID: {row.id}")
         print(f"API Token: {api_token}")
         print(f"Token Hash (stored): {token_hash}")
         print("\n📝 Admin login credentials:")